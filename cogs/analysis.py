@@ -0,0 +1,140 @@
+"""Analysis Cog, runs CPU-heavy raid detection off the event loop."""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import os
+from typing import Any, Callable, NamedTuple
+
+from discord.ext import commands
+
+BATCH_DELAY = 0.05  # seconds to wait for other guilds to queue work
+BATCH_SIZE = 64  # jobs per worker call
+MAX_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+# forking the running bot would copy its threads and gateway socket
+START_METHOD = (
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods()
+    else 'spawn'
+)
+
+
+class Job(NamedTuple):
+    """A payload waiting to be handed to a worker process."""
+    func: Callable[[Any], Any]
+    guild_id: int
+    payload: Any
+    future: asyncio.Future
+
+
+def run_batch(func, payloads):
+    """
+    Runs inside a worker process.
+
+    Errors are returned per payload so one bad job does not fail the batch.
+    """
+    results = []
+    for payload in payloads:
+        try:
+            results.append((True, func(payload)))
+        except Exception as error:
+            results.append((False, error))
+    return results
+
+
+def new_pool():
+    """Creates the worker pool, workers start from a clean process."""
+    return ProcessPoolExecutor(
+        max_workers=MAX_WORKERS,
+        mp_context=multiprocessing.get_context(START_METHOD)
+    )
+
+
+class Analysis(commands.Cog):
+    """Background process pool for heavy raid detection."""
+    def __init__(self, bot):
+        self.bot = bot
+        self.pool = new_pool()
+        self.pending = []
+        self.running = set()  # keeps batch tasks referenced
+        self.flusher = None
+
+    def cog_unload(self):
+        """Cancels queued jobs and shuts the pool down."""
+        for job in self.pending:
+            job.future.cancel()
+        self.pending = []
+        self.pool.shutdown(wait=False)
+
+    async def submit(self, func, guild_id, payload):
+        """
+        Runs `func(payload)` in a worker process and returns the result.
+
+        `func` must be a module-level function so it can be pickled.
+        Cancelling the awaiting task drops the job if it has not started.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append(Job(func, guild_id, payload, future))
+
+        if self.flusher is None or self.flusher.done():
+            self.flusher = loop.create_task(self.flush())
+
+        return await future
+
+    def cancel_guild(self, guild_id):
+        """Cancels every queued job belonging to a guild."""
+        for job in self.pending:
+            if job.guild_id == guild_id:
+                job.future.cancel()
+
+    async def flush(self):
+        """Groups queued jobs from every guild into worker calls."""
+        while self.pending:
+            await asyncio.sleep(BATCH_DELAY)
+
+            jobs, self.pending = self.pending, []
+            batches = {}
+            for job in jobs:
+                if not job.future.cancelled():
+                    batches.setdefault(job.func, []).append(job)
+
+            for func, func_jobs in batches.items():
+                for i in range(0, len(func_jobs), BATCH_SIZE):
+                    task = asyncio.ensure_future(
+                        self.run_jobs(func, func_jobs[i:i + BATCH_SIZE])
+                    )
+                    self.running.add(task)
+                    task.add_done_callback(self.running.discard)
+
+    async def run_jobs(self, func, jobs):
+        """Sends one batch to the pool and resolves each job's future."""
+        loop = asyncio.get_running_loop()
+        payloads = [job.payload for job in jobs]
+        pool = self.pool
+
+        try:
+            results = await loop.run_in_executor(
+                pool, run_batch, func, payloads
+            )
+        except BrokenProcessPool as error:
+            # a worker died, e.g. killed for memory, later jobs get a new pool
+            if pool is self.pool:
+                pool.shutdown(wait=False)
+                self.pool = new_pool()
+            results = [(False, error)] * len(jobs)
+        except Exception as error:
+            results = [(False, error)] * len(jobs)
+
+        for job, (success, value) in zip(jobs, results):
+            if job.future.done():  # cancelled while running
+                continue
+            if success:
+                job.future.set_result(value)
+            else:
+                job.future.set_exception(value)
+
+
+def setup(bot):
+    """Adds the Analysis cog to the bot."""
+    bot.add_cog(Analysis(bot))
@@ -0,0 +1,321 @@
+"""AntiNuke Cog, stops a single account from tearing the guild down."""
+
+import asyncio
+from collections import deque
+from datetime import datetime, timedelta
+import time
+
+import discord
+from discord.ext import commands
+
+from cogs import scheduler
+from cogs.cases import record
+from cogs.options import guild_options
+
+
+NUKE_LIMIT = 4  # deletions and webhooks allowed per actor per window
+BAN_LIMIT = 12  # bans, moderators may ban a handful of raiders by hand
+NUKE_WINDOW = 15  # seconds
+AUDIT_DELAY = 1.5  # seconds to gather events before one audit log read
+AUDIT_LIMIT = 500  # most entries read per action type in one fetch
+
+TRACKED = {
+    discord.AuditLogAction.channel_delete: 'Channel Deleted',
+    discord.AuditLogAction.role_delete: 'Role Deleted',
+    discord.AuditLogAction.ban: 'Member Banned',
+    discord.AuditLogAction.webhook_create: 'Webhook Created',
+}
+
+
+class AntiNuke(commands.Cog):
+    """Detects mass deletions and bans by one moderator."""
+    def __init__(self, bot):
+        self.bot = bot
+        self.waiting = {}  # guild_id -> {action: [(target_id, future)]}
+        self.fetchers = {}  # guild_id -> audit log fetch task
+        self.actions = {}  # (guild_id, actor_id) -> deque of timestamps
+        self.deleted = {}  # (guild_id, actor_id) -> deque of (time, channel)
+        self.stripped = {}  # (guild_id, actor_id) -> time roles removed
+        self.pruned = time.monotonic()  # last time idle actors were dropped
+        self.seen_webhooks = deque(maxlen=AUDIT_LIMIT)  # audit entry IDs
+
+    async def attribute(self, guild, action, target_id):
+        """
+        Finds who performed an action through the audit log.
+
+        Every event of a guild arriving within `AUDIT_DELAY` shares one
+        audit log read per action type, so a nuke of 100 channels costs
+        one fetch rather than 100.
+        """
+        future = asyncio.get_running_loop().create_future()
+        actions = self.waiting.setdefault(guild.id, {})
+        actions.setdefault(action, []).append((target_id, future))
+
+        if guild.id not in self.fetchers:
+            self.fetchers[guild.id] = asyncio.ensure_future(
+                self.fetch_audit_logs(guild)
+            )
+
+        return await future
+
+    async def fetch_audit_logs(self, guild):
+        """Reads the audit log once per action type for queued events."""
+        await asyncio.sleep(AUDIT_DELAY)
+        actions = self.waiting.pop(guild.id, {})
+        self.fetchers.pop(guild.id, None)
+
+        after = datetime.utcnow() - timedelta(seconds=NUKE_WINDOW * 2)
+
+        for action, waiters in actions.items():
+            actors = {}
+            created = []  # unseen webhook creations, newest first
+            try:
+                async for entry in guild.audit_logs(
+                    limit=min(AUDIT_LIMIT, max(100, len(waiters))),
+                    action=action
+                ):
+                    if entry.created_at < after:
+                        break
+                    if action == discord.AuditLogAction.webhook_create and \
+                            entry.id not in self.seen_webhooks:
+                        created.append(entry)
+                    target = getattr(entry.target, 'id', None)
+                    actors.setdefault(target, entry.user)
+            except discord.HTTPException:
+                pass
+
+            for target_id, future in waiters:
+                if future.done():
+                    continue
+                if target_id is None:  # webhooks, oldest unseen creation
+                    entry = created.pop() if created else None
+                    if entry:
+                        self.seen_webhooks.append(entry.id)
+                    future.set_result(entry and entry.user)
+                else:
+                    future.set_result(actors.get(target_id))
+
+    def prune(self, now):
+        """Forgets actors with nothing left in their windows."""
+        self.pruned = now
+        self.actions = {
+            key: actions for key, actions in self.actions.items()
+            if now - actions[-1] <= NUKE_WINDOW
+        }
+        self.deleted = {
+            key: deleted for key, deleted in self.deleted.items()
+            if now - deleted[-1][0] <= NUKE_WINDOW * 2
+        }
+        self.stripped = {
+            key: stripped_at for key, stripped_at in self.stripped.items()
+            if now - stripped_at < NUKE_WINDOW * 4
+        }
+
+    def record(self, guild, actor, action):
+        """
+        Counts an action and returns the actor's total in the window.
+
+        Bans are counted apart from the other actions.
+        """
+        now = time.monotonic()
+        if now - self.pruned > NUKE_WINDOW * 4:
+            self.prune(now)
+
+        key = (guild.id, actor.id, action == discord.AuditLogAction.ban)
+        actions = self.actions.setdefault(key, deque())
+        actions.append(now)
+
+        while actions and now - actions[0] > NUKE_WINDOW:
+            actions.popleft()
+
+        return len(actions)
+
+    async def track(self, guild, action, target_id, channel=None):
+        """Attributes an action and responds if the actor is nuking."""
+        actor = await self.attribute(guild, action, target_id)
+
+        if actor is None or actor.id == self.bot.user.id:
+            return
+
+        key = (guild.id, actor.id)
+        if channel is not None:
+            deleted = self.deleted.setdefault(key, deque())
+            deleted.append((time.monotonic(), channel))
+            while time.monotonic() - deleted[0][0] > NUKE_WINDOW * 2:
+                deleted.popleft()
+
+        count = self.record(guild, actor, action)
+        limit = BAN_LIMIT if action == discord.AuditLogAction.ban \
+            else NUKE_LIMIT
+
+        stripped_at = self.stripped.get(key)
+        if stripped_at and time.monotonic() - stripped_at < NUKE_WINDOW * 4:
+            if channel is not None:  # already handled, keep restoring
+                await self.restore(guild, [channel])
+            return
+        if count < limit:
+            return
+
+        self.stripped[key] = time.monotonic()
+        stripped = await self.strip(guild, actor)
+
+        deleted = self.deleted.pop(key, deque())
+        now = time.monotonic()
+        channels = [
+            deleted_channel for when, deleted_channel in deleted
+            if now - when <= NUKE_WINDOW * 2
+        ]
+        restored = await self.restore(guild, channels)
+
+        await self.alert(guild, actor, action, count, stripped, restored)
+
+    async def strip(self, guild, actor):
+        """Removes every role the actor can lose. Returns success."""
+        try:
+            member = guild.get_member(actor.id) or \
+                await guild.fetch_member(actor.id)
+        except discord.HTTPException:
+            return False
+
+        if member.id == guild.owner_id:
+            return False
+        if member.top_role >= guild.me.top_role:
+            return False
+
+        try:
+            await scheduler.high(
+                self.bot, ('member', guild.id), member.edit,
+                roles=[role for role in member.roles[1:] if role.managed],
+                reason='Anti-nuke: mass destructive actions'
+            )
+        except discord.HTTPException:
+            return False
+
+        record(
+            self.bot, guild, 'strip', member, guild.me,
+            'Anti-nuke: mass destructive actions'
+        )
+        return True
+
+    async def restore(self, guild, channels):
+        """Recreates deleted channels from their cached overwrites."""
+        lockdown = self.bot.get_cog('Lockdown')
+        restored = []
+        categories = {}  # deleted category ID -> recreated category ID
+
+        # categories first so their children can be placed back inside
+        channels = sorted(
+            channels,
+            key=lambda channel: channel.type != discord.ChannelType.category
+        )
+        for channel in channels:
+            # the cached channel is gone from the guild, safe to repoint
+            channel.category_id = categories.get(
+                channel.category_id, channel.category_id
+            )
+            try:
+                new_channel = await scheduler.high(
+                    self.bot, ('guild', guild.id), channel.clone,
+                    reason='Anti-nuke: restoring deleted channel'
+                )
+                await scheduler.high(
+                    self.bot, ('channel', new_channel.id), new_channel.edit,
+                    position=channel.position
+                )
+            except discord.HTTPException:
+                continue
+
+            if channel.type == discord.ChannelType.category:
+                categories[channel.id] = new_channel.id
+
+            # locked channels stay locked and can still be unlocked
+            if lockdown:
+                await lockdown.move_snapshot(guild, channel.id, new_channel.id)
+
+            restored.append(new_channel)
+
+        return restored
+
+    async def alert(self, guild, actor, action, count, stripped, restored):
+        """Reports a stopped nuke to the private_log channel."""
+        options = guild_options(self.bot, guild)
+
+        if options is None:
+            return
+
+        channel = options['private_log']
+
+        if not channel:
+            return
+
+        channel = guild.get_channel(channel)
+
+        nuke_embed = discord.Embed(
+            title='Nuke Detected!',
+            description=f'{count} destructive actions in {NUKE_WINDOW} ' +
+            'seconds by one account!',
+            color=discord.Color.blue()
+        )
+        nuke_embed.set_author(
+            name=actor,
+            icon_url=actor.avatar_url
+        )
+        nuke_embed.add_field(
+            name='Actor',
+            value=actor.mention,
+            inline=False
+        )
+        nuke_embed.add_field(
+            name='Last Action',
+            value=TRACKED[action],
+            inline=False
+        )
+        nuke_embed.add_field(
+            name='Roles Removed',
+            value='Yes' if stripped else 'No, please act manually!',
+            inline=False
+        )
+        if restored:
+            nuke_embed.add_field(
+                name='Channels Restored',
+                value=' '.join(channel.mention for channel in restored),
+                inline=False
+            )
+
+        scheduler.low(
+            self.bot, ('message', channel.id), channel.send, embed=nuke_embed
+        )
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel):
+        """Tracks deleted channels."""
+        await self.track(
+            channel.guild,
+            discord.AuditLogAction.channel_delete,
+            channel.id,
+            channel=channel
+        )
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role):
+        """Tracks deleted roles."""
+        await self.track(
+            role.guild, discord.AuditLogAction.role_delete, role.id
+        )
+
+    @commands.Cog.listener()
+    async def on_member_ban(self, guild, user):
+        """Tracks bans."""
+        await self.track(guild, discord.AuditLogAction.ban, user.id)
+
+    @commands.Cog.listener()
+    async def on_webhooks_update(self, channel):
+        """Tracks webhook creation, the event does not say which webhook."""
+        await self.track(
+            channel.guild, discord.AuditLogAction.webhook_create, None
+        )
+
+
+def setup(bot):
+    """Adds the AntiNuke cog to the bot."""
+    bot.add_cog(AntiNuke(bot))
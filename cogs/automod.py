@@ -0,0 +1,235 @@
+"""AutoMod Cog, filters words, patterns and links in every message."""
+
+from array import array
+import hashlib
+import re
+
+from discord.ext import commands
+
+from cogs import options  # circular, only used at runtime
+
+BLOCKLIST_PATH = './data/blocklist.txt'
+MAX_BLOCKLIST = 4_000_000  # domains, caps the table at 64 MiB
+ACTIONS = ('delete', 'warn', 'mute', 'kick')
+INVITE_HOSTS = ('discord.gg', 'discord.com', 'discordapp.com')
+LINKS = re.compile(
+    r'https?://(?P<host>[^\s/:?#<>]+)(?P<path>/\S*)?'
+    r'|(?<![\w.])(?P<invite>discord\.gg|discord(?:app)?\.com/invite)/\w'
+)
+
+
+def trie_pattern(words):
+    """
+    Builds a regex shaped like a trie of the given literals.
+
+    Alternatives never share a first character, so the regex engine
+    follows a single branch per position, much like Aho-Corasick.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word.lower():
+            node = node.setdefault(char, {})
+        node[''] = {}  # end of a word
+
+    def emit(node):
+        branches = [
+            re.escape(char) + emit(child)
+            for char, child in sorted(node.items()) if char
+        ]
+        if not branches:
+            return ''
+        if len(branches) == 1 and '' not in node:
+            return branches[0]
+        group = '(?:' + '|'.join(branches) + ')'
+        return group + '?' if '' in node else group
+
+    return emit(trie)
+
+
+def compile_rules(options):
+    """
+    Compiles a guild's rules into one regex and its rule labels.
+
+    Returns None if the guild has no rules. Raises re.error if a
+    pattern is invalid.
+    """
+    words = [word for word in options.get('automod_words', []) if word]
+    links = [link for link in options.get('automod_links', []) if link]
+    patterns = options.get('automod_regex', [])
+
+    parts = []
+    labels = {}
+
+    if words:
+        parts.append(rf'(?P<word>\b(?:{trie_pattern(words)})\b)')
+        labels['word'] = 'Blocked word'
+    if links:
+        parts.append(
+            r'(?P<link>(?:https?://)?(?<![\w.-])(?:[\w-]+\.)*' +
+            rf'(?:{trie_pattern(links)})(?![\w.-]*\w))'
+        )
+        labels['link'] = 'Blocked link'
+    for i, pattern in enumerate(patterns):
+        parts.append(f'(?P<regex{i}>{pattern})')
+        labels[f'regex{i}'] = f'Blocked pattern #{i + 1}'
+
+    if not parts:
+        return None
+
+    return re.compile('|'.join(parts), re.IGNORECASE), labels
+
+
+def domain_hash(domain):
+    """64-bit hash of a domain, never 0 since 0 marks an empty slot."""
+    digest = hashlib.blake2b(domain.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+
+def read_domains(path):
+    """Yields domains from a blocklist or hosts file."""
+    try:
+        with open(path, 'r') as blocklist_file:
+            for line in blocklist_file:
+                line = line.split('#', 1)[0].split()
+                if line:  # hosts files put the domain last
+                    yield line[-1].lower().lstrip('*.')
+    except FileNotFoundError:
+        return
+
+
+class DomainSet:
+    """
+    Open-addressing hash set of domain hashes.
+
+    Only 64-bit hashes are kept in a flat array at a load factor of at
+    most one half, so each domain costs 16 bytes and a lookup probes a
+    few slots no matter how many domains are loaded.
+    """
+    def __init__(self, path=BLOCKLIST_PATH):
+        count = min(MAX_BLOCKLIST, sum(1 for _ in read_domains(path)))
+        size = 8
+        while size < count * 2:
+            size *= 2
+
+        self.mask = size - 1
+        self.table = array('Q', bytes(8 * size))
+        self.count = 0
+
+        for domain in read_domains(path):
+            if self.count >= count:
+                break
+            self.add(domain)
+
+    def slot(self, value):
+        """Finds the slot holding a hash, or the empty slot for it."""
+        i = value & self.mask
+        while self.table[i] and self.table[i] != value:
+            i = (i + 1) & self.mask
+        return i
+
+    def add(self, domain):
+        """Adds a domain to the set."""
+        value = domain_hash(domain)
+        i = self.slot(value)
+        if not self.table[i]:
+            self.table[i] = value
+            self.count += 1
+
+    def __contains__(self, domain):
+        return self.table[self.slot(domain_hash(domain))] != 0
+
+    def blocks(self, host):
+        """Checks a host and each parent domain, e.g. a.evil.com, evil.com."""
+        labels = host.lower().rstrip('.').split('.')
+        return any(
+            '.'.join(labels[i:]) in self for i in range(len(labels) - 1)
+        )
+
+
+class AutoMod(commands.Cog):
+    """Automatically moderates messages that break the guild's rules."""
+    def __init__(self, bot):
+        self.bot = bot
+        self.rules = {}  # guild_id -> (compiled rules, action, invites)
+        self.blocklist = DomainSet()
+
+    def invalidate(self, guild):
+        """Forgets a guild's compiled rules, called when they change."""
+        self.rules.pop(guild.id, None)
+
+    def get_rules(self, guild):
+        """Returns the compiled rules, compiling them on first use."""
+        if guild.id not in self.rules:
+            settings = options.guild_options(self.bot, guild) or {}
+            try:
+                rules = compile_rules(settings)
+            except re.error:
+                rules = None
+            self.rules[guild.id] = (
+                rules,
+                settings.get('automod_action', 'delete'),
+                settings.get('automod_invites', False)
+            )
+
+        return self.rules[guild.id]
+
+    def scan_links(self, content, invites):
+        """Finds invites and blocked domains, skipping link-free messages."""
+        lowered = content.lower()
+        if 'http' not in lowered and 'discord.gg' not in lowered and \
+                '/invite/' not in lowered:
+            return None
+
+        for match in LINKS.finditer(lowered):
+            host, path = match.group('host'), match.group('path') or ''
+
+            if match.group('invite') or host == 'discord.gg' or (
+                host in INVITE_HOSTS and path.startswith('/invite/')
+            ):
+                if invites:
+                    return 'Invite link'
+            elif self.blocklist.blocks(host):
+                return 'Blocked domain'
+
+        return None
+
+    @commands.Cog.listener()
+    async def on_message(self, message):
+        """Checks each message against the guild's rules in one pass."""
+        if not message.guild or message.author.bot:
+            return
+
+        rules, action, invites = self.get_rules(message.guild)
+        label = None
+
+        if rules is not None:
+            regex, labels = rules
+            match = regex.search(message.content)
+            if match:
+                label = labels[match.lastgroup]
+
+        label = label or self.scan_links(message.content, invites)
+
+        if not label:
+            return
+        if message.author.guild_permissions.manage_messages:
+            return
+
+        reason = f'AutoMod: {label}'
+        moderation = self.bot.get_cog('Moderation')
+
+        if action == 'delete' or moderation is None:
+            await message.delete()
+            return
+
+        # reuses the moderation commands, with the bot as moderator
+        ctx = await self.bot.get_context(message)
+        ctx.author = message.guild.me
+        command = getattr(moderation, action)
+        await ctx.invoke(command, message.author, reason=reason)
+
+
+def setup(bot):
+    """Adds the AutoMod cog to the bot."""
+    bot.add_cog(AutoMod(bot))
@@ -0,0 +1,124 @@
+"""AutoSlowmode Cog, throttles busy channels during message floods."""
+
+import asyncio
+import time
+
+from discord.ext import commands, tasks
+
+from cogs import options, scheduler  # options is circular, see automod
+
+TICK = 5  # seconds between controller runs
+SMOOTHING = 0.3  # EWMA weight of the newest tick
+RAISE_AT = 2.0  # messages per second before slowmode goes up a level
+LOWER_AT = 0.5  # messages per second before slowmode goes down a level
+HOLD = 30  # seconds a level is kept before the next change
+LEVELS = (0, 2, 5, 10, 15, 30, 60, 120, 300, 600, 1800, 3600, 21600)
+
+
+def parse_bounds(value):
+    """Parses `min-max` seconds, returns None for off or bad input."""
+    try:
+        lowest, highest = (int(part) for part in value.split('-'))
+    except ValueError:
+        return None
+    if 0 <= lowest <= highest <= 21600:
+        return [lowest, highest]
+    return None
+
+
+def next_level(delay, rate, bounds):
+    """Steps the slowmode one level up or down, within the bounds."""
+    lowest, highest = bounds
+
+    if rate > RAISE_AT:
+        higher = [level for level in LEVELS if level > delay]
+        delay = higher[0] if higher else delay
+    elif rate < LOWER_AT:
+        lower = [level for level in LEVELS if level < delay]
+        delay = lower[-1] if lower else delay
+
+    return min(max(delay, lowest), highest)
+
+
+class AutoSlowmode(commands.Cog):
+    """Adjusts slowmode automatically from each channel's message rate."""
+    def __init__(self, bot):
+        self.bot = bot
+        self.counts = {}  # channel_id -> messages this tick
+        self.rates = {}  # channel_id -> EWMA of messages per second
+        self.changed = {}  # channel_id -> time of the last edit
+        self.controller.start()
+
+    def cog_unload(self):
+        """Stops the controller."""
+        self.controller.cancel()
+
+    def snapshot_state(self):
+        """Message rates kept across restarts."""
+        return self.rates
+
+    def restore_state(self, state):
+        """Resumes the message rates from before the restart."""
+        self.rates.update(state)
+
+    @commands.Cog.listener()
+    async def on_message(self, message):
+        """Counts messages, the controller does the rest each tick."""
+        if message.guild:
+            channel_id = message.channel.id
+            self.counts[channel_id] = self.counts.get(channel_id, 0) + 1
+
+    @tasks.loop(seconds=TICK)
+    async def controller(self):
+        """Updates the rates and edits every channel that needs it."""
+        counts, self.counts = self.counts, {}
+
+        for channel_id in set(counts) | set(self.rates):
+            rate = counts.get(channel_id, 0) / TICK
+            self.rates[channel_id] = (
+                SMOOTHING * rate +
+                (1 - SMOOTHING) * self.rates.get(channel_id, rate)
+            )
+
+        now = time.monotonic()
+        edits = []
+
+        for channel_id, rate in list(self.rates.items()):
+            channel = self.bot.get_channel(channel_id)
+            bounds = None
+            if channel is not None and hasattr(channel, 'slowmode_delay'):
+                settings = options.guild_options(self.bot, channel.guild)
+                bounds = (settings or {}).get('auto_slowmode')
+
+            idle = bounds and rate < 0.01 and \
+                channel.slowmode_delay <= bounds[0]
+            if not bounds or idle:  # stop tracking
+                del self.rates[channel_id]
+                self.changed.pop(channel_id, None)
+                continue
+            if now - self.changed.get(channel_id, 0) < HOLD:
+                continue  # hysteresis, no flapping
+
+            delay = next_level(channel.slowmode_delay, rate, bounds)
+            if delay != channel.slowmode_delay:
+                self.changed[channel_id] = now
+                edits.append((channel, delay))
+
+        # one batch of edits per tick
+        await asyncio.gather(*(
+            scheduler.high(
+                self.bot, ('channel', channel.id), channel.edit,
+                slowmode_delay=delay, reason='Automatic slowmode'
+            )
+            for channel, delay in edits
+        ), return_exceptions=True)
+
+    @controller.before_loop
+    async def before_controller(self):
+        """Waits for the cache before reading channels."""
+        await self.bot.wait_until_ready()
+
+
+def setup(bot):
+    """Adds the AutoSlowmode cog to the bot."""
+    bot.add_cog(AutoSlowmode(bot))
@@ -0,0 +1,307 @@
+"""Backup Cog, streams moderation data out of and back into the bot."""
+
+import argparse
+import asyncio
+from collections import Counter
+import csv
+import gzip
+from itertools import islice
+import json
+import os
+import sys
+import time
+
+import discord
+from discord.ext import commands
+
+from cogs.cases import CASES_PATH, CaseLog
+
+STORES = {
+    'options': './data/options.json',
+    'warn': './data/warns.json',
+    'mute': './data/mutes.json',
+    'lock': './data/channels.json',
+}  # row kind -> JSON file keyed by guild
+FIELDS = ('kind', 'guild', 'key', 'value')
+BATCH = 10000  # rows merged at once on import
+UPLOAD_LIMIT = 8 * 1024 * 1024  # bytes, larger exports stay on disk
+READ_RETRIES = 5  # tries to read a JSON file the bot is rewriting
+
+
+def read_store(path):
+    """Reads a JSON file, retrying if it is halfway through a rewrite."""
+    for _ in range(READ_RETRIES - 1):
+        try:
+            with open(path, 'r') as store_file:
+                return json.load(store_file)
+        except json.JSONDecodeError:
+            time.sleep(0.1)
+
+    with open(path, 'r') as store_file:
+        return json.load(store_file)
+
+
+def snapshot():
+    """Reads every store and the length of the append-only case file."""
+    stores = {kind: read_store(path) for kind, path in STORES.items()}
+    cases_end = os.path.getsize(CASES_PATH) if os.path.exists(
+        CASES_PATH
+    ) else 0
+    return stores, cases_end
+
+
+def export_rows(stores, cases_end, guild_key=None):
+    """
+    Yields `(kind, guild, key, value)` rows, one guild at a time.
+
+    Cases follow in the order they were logged, read line by line up to
+    `cases_end`, so cases logged during the export are left out.
+    """
+    for guild in sorted(set().union(*stores.values()), key=int):
+        if guild_key and guild != guild_key:
+            continue
+
+        if guild in stores['options']:
+            yield 'options', guild, '', stores['options'][guild]
+        for kind in ('warn', 'mute', 'lock'):
+            for key, value in stores[kind].get(guild, {}).items():
+                yield kind, guild, key, value
+
+    if not cases_end:
+        return
+
+    with open(CASES_PATH, 'rb') as cases_file:
+        while cases_file.tell() < cases_end:
+            line = cases_file.readline()
+            try:
+                case = json.loads(line)
+            except ValueError:
+                continue  # blank, or corrupt and skipped by the case log
+            if guild_key and str(case['guild']) != guild_key:
+                continue
+            yield 'case', str(case['guild']), str(case['case']), case
+
+
+def is_csv(path):
+    """Whether a path names a CSV export rather than JSON Lines."""
+    return '.csv' in os.path.basename(path)
+
+
+def write_rows(rows, path):
+    """Writes rows as gzipped JSON Lines or CSV, returns how many."""
+    count = 0
+
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as out_file:
+        if is_csv(path):
+            writer = csv.writer(out_file)
+            writer.writerow(FIELDS)
+            for kind, guild, key, value in rows:
+                writer.writerow((kind, guild, key, json.dumps(value)))
+                count += 1
+        else:
+            for row in rows:
+                out_file.write(json.dumps(dict(zip(FIELDS, row))) + '\n')
+                count += 1
+
+    return count
+
+
+def read_rows(path):
+    """Yields the rows of an export, streamed from the file."""
+    with gzip.open(path, 'rt', encoding='utf-8', newline='') as in_file:
+        if is_csv(path):
+            reader = csv.reader(in_file)
+            next(reader, None)  # header
+            for kind, guild, key, value in reader:
+                yield kind, guild, key, json.loads(value)
+        else:
+            for line in in_file:
+                if line.strip():
+                    row = json.loads(line)
+                    yield tuple(row[field] for field in FIELDS)
+
+
+def apply_rows(rows, case_log):
+    """
+    Merges a batch of rows into the stores, returns a count per kind.
+
+    Each store the batch touches is read, updated and written once.
+    Cases already in the log are skipped, so importing twice is safe.
+    """
+    counts = Counter(row[0] for row in rows if row[0] in STORES)
+    stores = {
+        kind: read_store(STORES[kind]) for kind in counts if kind in STORES
+    }
+
+    for kind, guild, key, value in rows:
+        if kind == 'case':
+            # cases up to the guild's last number are already logged
+            if value['case'] > len(case_log.offsets.get(value['guild'], ())):
+                case_log.append(value)
+                counts[kind] += 1
+        elif kind == 'options':
+            stores[kind][guild] = value
+        elif kind in stores:
+            stores[kind].setdefault(guild, {})[key] = value
+
+    for kind, store in stores.items():
+        with open(STORES[kind], 'w') as store_file:
+            json.dump(store, store_file, indent=2)
+
+    return counts
+
+
+def summary(counts):
+    """Describes row counts, e.g. `3 options, 120 case`."""
+    return ', '.join(
+        f'{count} {kind}' for kind, count in sorted(counts.items())
+    ) or 'nothing'
+
+
+class Backup(commands.Cog):
+    """Exports and imports warns, mutes, locks, options and cases."""
+    def __init__(self, bot):
+        self.bot = bot
+
+    @commands.group(invoke_without_command=True)
+    async def backup(self, ctx):
+        """
+        Exports or imports moderation data (Owner only!)
+
+        Paths ending in `.csv.gz` are CSV, others gzipped JSON Lines.
+        **Example:** `.backup export ./backup.jsonl.gz`
+        """
+        await ctx.send(
+            'Please use `.backup export <path> [guild ID]` or ' +
+            '`.backup import <path>`!'
+        )
+
+    @backup.command(name='export')
+    @commands.is_owner()
+    async def export(self, ctx, path, guild_id: int = None):
+        """
+        Streams moderation data to a file, one guild at a time.
+
+        **Example:** `.backup export ./backup.csv.gz`
+        """
+        # read in one go on the event loop, so nothing changes midway
+        stores, cases_end = snapshot()
+        guild_key = str(guild_id) if guild_id else None
+
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            count = await loop.run_in_executor(
+                None, write_rows, export_rows(stores, cases_end, guild_key),
+                path
+            )
+        except OSError:
+            await ctx.send('Could not write that file!')
+            return
+        took = time.perf_counter() - start
+
+        message = f'Exported **{count}** rows to `{path}` in `{took:.1f}` s!'
+        if os.path.getsize(path) <= UPLOAD_LIMIT:
+            await ctx.send(message, file=discord.File(path))
+        else:
+            await ctx.send(message)
+
+    @backup.command(name='import')
+    @commands.is_owner()
+    async def import_(self, ctx, path=None):
+        """
+        Streams moderation data back in from an attachment or a file.
+
+        **Example:** `.backup import ./backup.jsonl.gz`
+        """
+        if ctx.message.attachments:
+            attachment = ctx.message.attachments[0]
+            path = f'./data/import-{attachment.filename}'
+            await attachment.save(path)
+        elif not path:
+            await ctx.send('Please attach a file or give a path!')
+            return
+
+        cases = self.bot.get_cog('Cases')
+        case_log = cases.log if cases else CaseLog(CASES_PATH)
+        rows = read_rows(path)
+        counts = Counter()
+
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                # parsed in a thread, merged on the event loop
+                batch = await loop.run_in_executor(
+                    None, lambda: list(islice(rows, BATCH))
+                )
+                if not batch:
+                    break
+                counts += apply_rows(batch, case_log)
+                self.reload()  # before the cogs write their own copy
+        except (OSError, ValueError, KeyError):
+            await ctx.send(
+                f'Could not read that file! Imported {summary(counts)}.'
+            )
+            return
+        finally:
+            if not cases:
+                case_log.close()
+
+        await ctx.send(f'Imported {summary(counts)}!')
+
+    def reload(self):
+        """Has the cogs pick up the imported data."""
+        moderation = self.bot.get_cog('Moderation')
+        if moderation:
+            moderation.load()
+
+        automod = self.bot.get_cog('AutoMod')
+        if automod:
+            automod.rules.clear()
+
+
+def main(argv):
+    """Command line entry point, run from the bot's directory."""
+    parser = argparse.ArgumentParser(
+        prog='python -m cogs.backup',
+        description='Exports or imports moderation data. Exporting is '
+        'safe while the bot runs, import with `.backup import` instead.'
+    )
+    commands_ = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands_.add_parser('export')
+    export_parser.add_argument('path', help='.jsonl.gz or .csv.gz file')
+    export_parser.add_argument('--guild', type=int, help='one guild only')
+    import_parser = commands_.add_parser('import')
+    import_parser.add_argument('path', help='.jsonl.gz or .csv.gz file')
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        stores, cases_end = snapshot()
+        guild_key = str(args.guild) if args.guild else None
+        count = write_rows(
+            export_rows(stores, cases_end, guild_key), args.path
+        )
+        print(f'Exported {count} rows to {args.path}')
+        return
+
+    case_log = CaseLog(CASES_PATH)
+    rows = read_rows(args.path)
+    counts = Counter()
+    try:
+        while True:
+            batch = list(islice(rows, BATCH))
+            if not batch:
+                break
+            counts += apply_rows(batch, case_log)
+    finally:
+        case_log.close()
+    print(f'Imported {summary(counts)}')
+
+
+def setup(bot):
+    """Adds the Backup cog to the bot."""
+    bot.add_cog(Backup(bot))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
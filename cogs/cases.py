@@ -0,0 +1,274 @@
+"""Cases Cog, one log of every moderation action."""
+
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime
+import json
+import os
+import time
+
+import discord
+from discord.ext import commands
+
+CASES_PATH = './data/cases.jsonl'  # one JSON case per line, append only
+CASES_PER_PAGE = 10
+MODSTATS_LISTED = 20  # moderators shown by the modstats command
+ACTIONS = ('warn', 'mute', 'unmute', 'kick', 'ban', 'unban', 'strip')
+MISSING = (1 << 64) - 1  # offset of a case whose line is corrupt
+
+
+class CaseLog:
+    """
+    Append-only case file with in-memory indexes.
+
+    Only file offsets and IDs are kept in memory, cases are read from
+    the file when shown. Cases are numbered per guild in time order, so
+    every index is a sorted array of case numbers searched by bisection.
+    """
+    def __init__(self, path):
+        self.offsets = {}  # guild_id -> array of file offsets, by case
+        self.times = {}  # guild_id -> array of case times
+        self.by_target = {}  # (guild_id, target_id) -> array of cases
+        self.by_moderator = {}  # (guild_id, moderator_id) -> array
+        self.actions = {}  # guild_id -> {moderator_id: Counter}
+
+        if not os.path.exists(path):
+            open(path, 'wb').close()
+        self.file = open(path, 'r+b')
+
+        offset = 0
+        for line in self.file:
+            if not line.endswith(b'\n'):  # torn by a crash mid-write
+                self.file.truncate(offset)
+                break
+            try:
+                if line.strip():
+                    self.index(json.loads(line), offset)
+            except ValueError:
+                pass  # corrupt line, the rest of the log is still good
+            offset += len(line)
+
+    def close(self):
+        """Closes the case file."""
+        self.file.close()
+
+    def index(self, case, offset):
+        """Adds a case to every index."""
+        guild_id = case['guild']
+        offsets = self.offsets.setdefault(guild_id, array('Q'))
+        times = self.times.setdefault(guild_id, array('d'))
+
+        # never earlier than the case before, so bisection still works
+        # for imported cases older than the ones already logged
+        case_time = max(case['time'], times[-1]) if times else case['time']
+
+        # keeps case N at position N - 1 past skipped corrupt lines
+        while len(offsets) < case['case'] - 1:
+            offsets.append(MISSING)
+            times.append(case_time)
+
+        offsets.append(offset)
+        times.append(case_time)
+        self.by_target.setdefault(
+            (guild_id, case['target']), array('Q')
+        ).append(case['case'])
+        self.by_moderator.setdefault(
+            (guild_id, case['moderator']), array('Q')
+        ).append(case['case'])
+        self.actions.setdefault(guild_id, {}).setdefault(
+            case['moderator'], Counter()
+        )[case['action']] += 1
+
+    def add(self, guild_id, action, target_id, moderator_id, reason):
+        """Appends a case and returns its number."""
+        return self.append({
+            'guild': guild_id,
+            'action': action,
+            'target': target_id,
+            'moderator': moderator_id,
+            'reason': reason,
+            'time': time.time(),
+        })
+
+    def append(self, case):
+        """Appends a case, numbered after the guild's last one."""
+        case = dict(case, case=len(self.offsets.get(case['guild'], ())) + 1)
+
+        offset = self.file.seek(0, os.SEEK_END)
+        self.file.write(json.dumps(case).encode() + b'\n')
+        self.file.flush()
+        self.index(case, offset)
+
+        return case['case']
+
+    def get(self, guild_id, number):
+        """Reads one case, None if it does not exist."""
+        offsets = self.offsets.get(guild_id, ())
+        if not 0 < number <= len(offsets) or offsets[number - 1] == MISSING:
+            return None
+
+        self.file.seek(offsets[number - 1])
+        return json.loads(self.file.readline())
+
+    def page(self, numbers, page):
+        """Case numbers on one page, newest first."""
+        end = len(numbers) - (page - 1) * CASES_PER_PAGE
+        start = max(end - CASES_PER_PAGE, 0)
+        return [numbers[i] for i in range(end - 1, start - 1, -1)]
+
+    def first_since(self, guild_id, since):
+        """Number of the first case at or after a time."""
+        return bisect_left(self.times.get(guild_id, ()), since) + 1
+
+
+def record(bot, guild, action, target, moderator, reason):
+    """Logs a moderation action as a case, if the Cases cog is loaded."""
+    cases = bot.get_cog('Cases')
+    if cases:
+        return cases.log.add(
+            guild.id, action, target.id, moderator.id, reason
+        )
+    return None
+
+
+class Cases(commands.Cog):
+    """Searchable log of warns, mutes, kicks and bans."""
+    def __init__(self, bot):
+        self.bot = bot
+        self.log = CaseLog(CASES_PATH)
+
+    def cog_unload(self):
+        """Closes the case file."""
+        self.log.close()
+
+    def case_line(self, case):
+        """Describes a case in one line."""
+        date = datetime.utcfromtimestamp(case['time']).strftime('%Y-%m-%d')
+        return (
+            f'{case["reason"][:200]} by <@{case["moderator"]}>, ' +
+            f'{date}'
+        )
+
+    @commands.command()
+    @commands.cooldown(1, 3, commands.BucketType.member)
+    async def case(self, ctx, number: int):
+        """
+        Shows a moderation case.
+
+        **Example:** `.case 12`
+        """
+        case = self.log.get(ctx.guild.id, number)
+
+        if case is None:
+            await ctx.send('Invalid ID!')
+            return
+
+        case_embed = discord.Embed(
+            title=f'Case #{number}',
+            color=discord.Color.blue(),
+            timestamp=datetime.utcfromtimestamp(case['time'])
+        )
+        case_embed.add_field(
+            name='Action',
+            value=case['action'].capitalize(),
+            inline=False
+        )
+        case_embed.add_field(
+            name='User',
+            value=f'<@{case["target"]}> ({case["target"]})',
+            inline=False
+        )
+        case_embed.add_field(
+            name='Moderator',
+            value=f'<@{case["moderator"]}>',
+            inline=False
+        )
+        case_embed.add_field(
+            name='Reason',
+            value=case['reason'][:1024],
+            inline=False
+        )
+
+        await ctx.send(embed=case_embed)
+
+    @commands.command()
+    @commands.cooldown(1, 3, commands.BucketType.member)
+    async def cases(self, ctx, user: discord.User, page: int = 1):
+        """
+        Lists the cases of a user, newest first.
+
+        **Example:** `.cases @ACPlayGames 2`
+        """
+        numbers = self.log.by_target.get((ctx.guild.id, user.id), ())
+        pages = max((len(numbers) - 1) // CASES_PER_PAGE + 1, 1)
+
+        if not 0 < page <= pages:
+            await ctx.send(f'Please choose a page from 1 to {pages}!')
+            return
+
+        cases_embed = discord.Embed(
+            title='Cases',
+            description=f'**{user}** has {len(numbers)} cases!',
+            color=discord.Color.blue()
+        )
+        cases_embed.set_author(
+            name=user,
+            icon_url=user.avatar_url
+        )
+        cases_embed.set_footer(text=f'Page {page} of {pages}')
+
+        for number in self.log.page(numbers, page):
+            case = self.log.get(ctx.guild.id, number)
+            cases_embed.add_field(
+                name=f'#{number} {case["action"].capitalize()}',
+                value=self.case_line(case),
+                inline=False
+            )
+
+        await ctx.send(embed=cases_embed)
+
+    @commands.command()
+    @commands.cooldown(1, 3, commands.BucketType.member)
+    async def modstats(self, ctx, days: int = 30):
+        """
+        Counts the cases of each moderator, in total and recently.
+
+        **Example:** `.modstats 7`
+        """
+        first = self.log.first_since(ctx.guild.id, time.time() - days * 86400)
+
+        stats = []
+        guild_actions = self.log.actions.get(ctx.guild.id, {})
+        for moderator_id, actions in guild_actions.items():
+            numbers = self.log.by_moderator[(ctx.guild.id, moderator_id)]
+            recent = len(numbers) - bisect_left(numbers, first)
+            stats.append((len(numbers), recent, moderator_id, actions))
+        stats.sort(reverse=True)
+
+        modstats_embed = discord.Embed(
+            title='Moderator Stats',
+            description=f'Cases in total and in the last {days} days!',
+            color=discord.Color.blue()
+        )
+
+        for total, recent, moderator_id, actions in stats[:MODSTATS_LISTED]:
+            counts = ', '.join(
+                f'{action} {actions[action]}'
+                for action in ACTIONS if actions[action]
+            )
+            modstats_embed.add_field(
+                name=f'{total} total, {recent} recent',
+                value=f'<@{moderator_id}>: {counts}',
+                inline=False
+            )
+
+        if not stats:
+            modstats_embed.description = 'No cases yet!'
+
+        await ctx.send(embed=modstats_embed)
+
+
+def setup(bot):
+    """Adds the Cases cog to the bot."""
+    bot.add_cog(Cases(bot))
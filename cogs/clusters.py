@@ -0,0 +1,372 @@
+"""Clusters Cog, groups recent joiners with near-identical usernames."""
+
+import asyncio
+from collections import deque
+import random
+import re
+import time
+import zlib
+
+import discord
+from discord.ext import commands
+
+from cogs import scheduler
+from cogs.cases import record
+from cogs.members import chunked
+from cogs.options import guild_options
+
+DEFAULT_REASON = 'No reason was provided.'
+
+RECENT_SECONDS = 3600  # joiners older than this leave the index
+RECENT_JOINERS = 5000  # hard cap per guild
+SHINGLE_SIZE = 3
+BANDS = 8
+ROWS = 4  # BANDS * ROWS hash functions, LSH threshold ~0.6
+SIMILARITY = 0.75  # estimated Jaccard needed to join a cluster
+BUCKET_SIZE = 32  # members kept per LSH bucket, bounds each insert
+CLUSTER_ALERT = 4  # members needed before a cluster is reported
+CLUSTER_LISTED = 30  # names shown in an embed
+
+MERSENNE = (1 << 61) - 1
+_seeds = random.Random(0x5EED)
+HASHES = [
+    (_seeds.randrange(1, MERSENNE), _seeds.randrange(0, MERSENNE))
+    for _ in range(BANDS * ROWS)
+]
+DIGITS = re.compile(r'\d+')
+
+
+def shingles(name):
+    """Normalises a username and splits it into character shingles."""
+    name = DIGITS.sub('#', name.lower())  # raider123 ~ raider124
+    if len(name) <= SHINGLE_SIZE:
+        return {name}
+    return {
+        name[i:i + SHINGLE_SIZE]
+        for i in range(len(name) - SHINGLE_SIZE + 1)
+    }
+
+
+def minhash(name):
+    """Computes the MinHash signature of a username."""
+    values = [zlib.crc32(shingle.encode()) for shingle in shingles(name)]
+    return tuple(
+        min((a * value + b) % MERSENNE for value in values)
+        for a, b in HASHES
+    )
+
+
+def similarity(sig_a, sig_b):
+    """Estimates the Jaccard similarity of two signatures."""
+    return sum(a == b for a, b in zip(sig_a, sig_b)) / len(sig_a)
+
+
+class NameIndex:
+    """LSH index over the usernames of a guild's recent joiners."""
+    def __init__(self):
+        self.recent = deque()  # (joined, member_id), oldest first
+        self.entries = {}  # member_id -> (name, signature, keys, joined)
+        self.buckets = {}  # band key -> set of member_ids
+        self.cluster_of = {}  # member_id -> cluster_id
+        self.clusters = {}  # cluster_id -> set of member_ids
+        self.alerts = {}  # cluster_id -> alert discord.Message
+        self.next_id = 1
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['alerts'] = {}  # messages are not kept across restarts
+        return state
+
+    def expire(self, now):
+        """Drops joiners that have fallen out of the window."""
+        while self.recent and (
+            now - self.recent[0][0] > RECENT_SECONDS
+            or len(self.recent) > RECENT_JOINERS
+        ):
+            joined, member_id = self.recent.popleft()
+            entry = self.entries.get(member_id)
+            if entry is not None and entry[3] == joined:  # not a rejoin
+                self.remove(member_id)
+
+    def remove(self, member_id):
+        """Removes a member from the buckets and their cluster."""
+        entry = self.entries.pop(member_id, None)
+        if entry is None:
+            return
+
+        for key in entry[2]:
+            bucket = self.buckets.get(key)
+            if bucket is None or member_id not in bucket:
+                continue  # the bucket was full when they joined
+            bucket.discard(member_id)
+            if not bucket:
+                del self.buckets[key]
+
+        cluster_id = self.cluster_of.pop(member_id, None)
+        if cluster_id is not None:
+            cluster = self.clusters[cluster_id]
+            cluster.discard(member_id)
+            if not cluster:
+                self.drop_cluster(cluster_id)
+
+    def drop_cluster(self, cluster_id):
+        """Forgets a cluster, its members stay in the index."""
+        for member_id in self.clusters.pop(cluster_id, ()):
+            self.cluster_of.pop(member_id, None)
+        self.alerts.pop(cluster_id, None)
+
+    def insert(self, member_id, name, now):
+        """
+        Adds a joiner and returns their cluster ID, or None.
+
+        Only members sharing an LSH bucket are compared, and only one of
+        them per cluster. Buckets hold at most `BUCKET_SIZE` members, a
+        look-alike of a full bucket still finds the cluster through the
+        members already in it.
+        """
+        self.expire(now)
+        self.remove(member_id)  # rejoined within the window
+
+        signature = minhash(name)
+        keys = [
+            (band, signature[band * ROWS:(band + 1) * ROWS])
+            for band in range(BANDS)
+        ]
+
+        candidates = set()
+        for key in keys:
+            candidates |= self.buckets.get(key, set())
+
+        similar = []
+        checked = set()
+        for other in candidates:
+            cluster_id = self.cluster_of.get(other)
+            if cluster_id is not None:
+                if cluster_id in checked:
+                    continue
+                checked.add(cluster_id)  # one representative per cluster
+            if similarity(signature, self.entries[other][1]) >= SIMILARITY:
+                similar.append(other)
+
+        matched = {
+            self.cluster_of[other] for other in similar
+            if other in self.cluster_of
+        }
+        loose = [other for other in similar if other not in self.cluster_of]
+
+        self.entries[member_id] = (name, signature, keys, now)
+        self.recent.append((now, member_id))
+        for key in keys:
+            bucket = self.buckets.setdefault(key, set())
+            if len(bucket) < BUCKET_SIZE:
+                bucket.add(member_id)
+
+        if not matched and not loose:
+            return None
+
+        # merge every matching cluster into the largest one
+        if matched:
+            cluster_id = max(matched, key=lambda c: len(self.clusters[c]))
+        else:
+            cluster_id = self.next_id
+            self.next_id += 1
+            self.clusters[cluster_id] = set()
+
+        for other_id in matched - {cluster_id}:
+            for other in self.clusters.pop(other_id):
+                self.cluster_of[other] = cluster_id
+                self.clusters[cluster_id].add(other)
+            alert = self.alerts.pop(other_id, None)
+            if alert and cluster_id not in self.alerts:
+                self.alerts[cluster_id] = alert
+
+        for other in loose + [member_id]:
+            self.cluster_of[other] = cluster_id
+            self.clusters[cluster_id].add(other)
+
+        return cluster_id
+
+    def names(self, cluster_id):
+        """Returns the member IDs and usernames of a cluster."""
+        return [
+            (member_id, self.entries[member_id][0])
+            for member_id in self.clusters.get(cluster_id, ())
+        ]
+
+
+class Clusters(commands.Cog):
+    """Detects groups of joiners with look-alike usernames."""
+    def __init__(self, bot):
+        self.bot = bot
+        self.indexes = {}  # guild_id -> NameIndex
+
+    def snapshot_state(self):
+        """Username indexes kept across restarts."""
+        return self.indexes
+
+    def restore_state(self, state):
+        """Resumes the username indexes from before the restart."""
+        self.indexes.update(state)
+
+    def cluster_embed(self, index, cluster_id):
+        """Creates the embed describing a cluster."""
+        members = index.names(cluster_id)
+        listed = '\n'.join(
+            f'<@{member_id}> `{name}`'
+            for member_id, name in members[:CLUSTER_LISTED]
+        )
+        if len(members) > CLUSTER_LISTED:
+            listed += f'\nand {len(members) - CLUSTER_LISTED} more'
+
+        cluster_embed = discord.Embed(
+            title=f'Username Cluster #{cluster_id}',
+            description=f'{len(members)} recent joiners share a name pattern!',
+            color=discord.Color.blue()
+        )
+        cluster_embed.add_field(
+            name='Members',
+            value=listed,
+            inline=False
+        )
+        cluster_embed.set_footer(
+            text=f'Do `.cluster {cluster_id} ban` to ban them all!'
+        )
+        return cluster_embed
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member):
+        """Indexes the joiner's username and reports new clusters."""
+        guild = member.guild
+        index = self.indexes.setdefault(guild.id, NameIndex())
+        cluster_id = index.insert(member.id, member.name, time.time())
+
+        if cluster_id is None:
+            return
+        if len(index.clusters[cluster_id]) < CLUSTER_ALERT:
+            return
+
+        # checks for the private_log channel
+        options = guild_options(self.bot, guild)
+
+        if options is None:
+            return
+
+        channel = options['private_log']
+
+        if not channel:
+            return
+
+        channel = guild.get_channel(channel)
+
+        # one alert per cluster, edited as the cluster grows
+        cluster_embed = self.cluster_embed(index, cluster_id)
+        alert = index.alerts.get(cluster_id)
+
+        if alert:
+            try:
+                await scheduler.low(
+                    self.bot, ('message', channel.id), alert.edit,
+                    embed=cluster_embed, merge_key=alert.id
+                )
+                return
+            except discord.NotFound:
+                pass
+
+        index.alerts[cluster_id] = await scheduler.low(
+            self.bot, ('message', channel.id), channel.send,
+            embed=cluster_embed
+        )
+
+    @commands.command()
+    @commands.cooldown(1, 3, commands.BucketType.member)
+    async def cluster(self, ctx, cluster_id: int = None, action=None, *,
+                      reason=DEFAULT_REASON):
+        """
+        Lists username clusters, or acts on a whole cluster.
+
+        Actions are `ban`, `kick` and `quarantine`.
+
+        **Example:** `.cluster 3 ban raiding`
+        """
+        index = self.indexes.get(ctx.guild.id, NameIndex())
+
+        if cluster_id is None:  # lists every cluster
+            clusters_embed = discord.Embed(
+                title='Username Clusters',
+                description=f'There are {len(index.clusters)} clusters!',
+                color=discord.Color.blue()
+            )
+            for listed_id in sorted(index.clusters)[:25]:
+                members = index.names(listed_id)
+                clusters_embed.add_field(
+                    name=f'#{listed_id} ({len(members)} members)',
+                    value=', '.join(f'`{name}`' for _, name in members[:5]),
+                    inline=False
+                )
+            await ctx.send(embed=clusters_embed)
+            return
+
+        if cluster_id not in index.clusters:
+            await ctx.send('Please input a valid cluster ID!')
+            return
+
+        if action is None:
+            await ctx.send(embed=self.cluster_embed(index, cluster_id))
+            return
+
+        action = action.lower()
+        member_ids = list(index.clusters[cluster_id])
+
+        if action == 'ban':
+            results = await asyncio.gather(*(
+                scheduler.high(
+                    self.bot, ('ban', ctx.guild.id), ctx.guild.ban,
+                    discord.Object(id=member_id), reason=reason
+                )
+                for member_id in member_ids
+            ), return_exceptions=True)
+        elif action == 'quarantine' and self.bot.get_cog('Lockdown'):
+            lockdown = self.bot.get_cog('Lockdown')
+            await chunked(self.bot, ctx.guild)
+            members = [
+                ctx.guild.get_member(member_id) for member_id in member_ids
+            ]
+            done = await lockdown.quarantine_members(
+                ctx.guild, [member for member in members if member]
+            )
+            results = [None] * done
+        elif action == 'kick':
+            results = await asyncio.gather(*(
+                scheduler.high(
+                    self.bot, ('kick', ctx.guild.id), ctx.guild.kick,
+                    discord.Object(id=member_id), reason=reason
+                )
+                for member_id in member_ids
+            ), return_exceptions=True)
+        else:
+            await ctx.send('Action must be `ban`, `kick` or `quarantine`!')
+            return
+
+        done = sum(1 for result in results if result is None)
+        index.drop_cluster(cluster_id)
+
+        if action in ('ban', 'kick'):
+            for member_id, result in zip(member_ids, results):
+                if result is None:
+                    record(
+                        self.bot, ctx.guild, action,
+                        discord.Object(id=member_id), ctx.author, reason
+                    )
+
+        past = {
+            'ban': 'banned', 'kick': 'kicked', 'quarantine': 'quarantined'
+        }[action]
+        await ctx.send(
+            f'Cluster **#{cluster_id}**: {done} of {len(member_ids)} ' +
+            f'members have been {past}!'
+        )
+
+
+def setup(bot):
+    """Adds the Clusters cog to the bot."""
+    bot.add_cog(Clusters(bot))
@@ -0,0 +1,209 @@
+"""Evasion Cog, links joiners to banned accounts they may belong to."""
+
+import json
+import re
+
+import discord
+from discord.ext import commands
+
+from cogs import scheduler
+from cogs.options import guild_options
+
+FINGERPRINTS_PATH = './data/fingerprints.json'
+SAVE_DELAY = 2  # seconds, bans in a burst are written to disk together
+
+CREATED_BUCKET = 86400  # seconds, accounts made the same day
+POINTS = {
+    'avatar': 3,
+    'name': 2,
+    'created': 1,
+}  # evasion points per matching feature, added to the alt score
+EVASION_ALERT = 2  # evasion points needed before reporting
+LEET = str.maketrans('013457@$', 'oieastas')
+TRAILING_DIGITS = re.compile(r'\d+$')
+NOT_LETTERS = re.compile(r'[^a-z]')
+
+
+def fingerprint(user):
+    """Compact features of an account: name, avatar and creation day."""
+    name = TRAILING_DIGITS.sub('', user.name.lower()).translate(LEET)
+    name = NOT_LETTERS.sub('', name)
+
+    return {
+        'name': name if len(name) >= 3 else None,
+        'avatar': user.avatar,  # None for default avatars
+        'created': (user.id >> 22) // 1000 // CREATED_BUCKET,
+    }
+
+
+class Evasion(commands.Cog):
+    """Detects banned users coming back on another account."""
+    def __init__(self, bot):
+        self.bot = bot
+        self.index = {}  # guild_id -> {(feature, value): set of user_ids}
+        self.saving = None  # pending save handle
+
+        # guild_key -> {user_key: fingerprint}
+        with open(FINGERPRINTS_PATH, 'r') as fingerprints_file:
+            self.prints = json.load(fingerprints_file)
+
+        for guild_key, guild_prints in self.prints.items():
+            for user_key, features in guild_prints.items():
+                self.index_add(int(guild_key), int(user_key), features)
+
+    def index_add(self, guild_id, user_id, features):
+        """Adds a banned user's features to the guild's hash index."""
+        index = self.index.setdefault(guild_id, {})
+        for feature, value in features.items():
+            if value is not None:
+                index.setdefault((feature, value), set()).add(user_id)
+
+    def index_remove(self, guild_id, user_id, features):
+        """Removes a banned user's features from the hash index."""
+        index = self.index.get(guild_id, {})
+        for feature, value in features.items():
+            users = index.get((feature, value))
+            if users:
+                users.discard(user_id)
+                if not users:
+                    del index[(feature, value)]
+
+    def cog_unload(self):
+        """Writes fingerprints still waiting to be saved."""
+        self.flush()
+
+    def schedule_save(self):
+        """Saves shortly, once for every change made in the meantime."""
+        if self.saving is None:
+            self.saving = self.bot.loop.call_later(SAVE_DELAY, self.save)
+
+    def flush(self):
+        """Saves at once if a save is pending."""
+        if self.saving is not None:
+            self.saving.cancel()
+            self.save()
+
+    def save(self):
+        """Writes every fingerprint to disk."""
+        self.saving = None
+        with open(FINGERPRINTS_PATH, 'w') as fingerprints_file:
+            json.dump(self.prints, fingerprints_file, indent=2)
+
+    def match(self, guild, user):
+        """
+        Finds the banned account that best matches a user.
+
+        Returns `(banned_id, points, features)` or None. Each feature is
+        one dictionary lookup, so the ban list is never scanned.
+        """
+        index = self.index.get(guild.id)
+        if not index:
+            return None
+
+        matches = {}  # banned_id -> matching features
+        for feature, value in fingerprint(user).items():
+            for banned_id in index.get((feature, value), ()):
+                if banned_id != user.id:
+                    matches.setdefault(banned_id, []).append(feature)
+
+        if not matches:
+            return None
+
+        banned_id, features = max(
+            matches.items(),
+            key=lambda item: sum(POINTS[feature] for feature in item[1])
+        )
+        points = sum(POINTS[feature] for feature in features)
+        return banned_id, points, features
+
+    @commands.Cog.listener()
+    async def on_member_ban(self, guild, user):
+        """Stores a fingerprint of every banned user."""
+        features = fingerprint(user)
+        guild_prints = self.prints.setdefault(str(guild.id), {})
+
+        old = guild_prints.get(str(user.id))
+        if old:
+            self.index_remove(guild.id, user.id, old)
+
+        guild_prints[str(user.id)] = features
+        self.index_add(guild.id, user.id, features)
+        self.schedule_save()
+
+    @commands.Cog.listener()
+    async def on_member_unban(self, guild, user):
+        """Forgets unbanned users."""
+        features = self.prints.get(str(guild.id), {}).pop(str(user.id), None)
+        if features:
+            self.index_remove(guild.id, user.id, features)
+            self.schedule_save()
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member):
+        """Reports joiners resembling a banned account."""
+        found = self.match(member.guild, member)
+        if not found or found[1] < EVASION_ALERT:
+            return
+
+        banned_id, points, features = found
+
+        # checks for the private_log channel
+        options = guild_options(self.bot, member.guild)
+
+        if options is None:
+            return
+
+        channel = options['private_log']
+
+        if not channel:
+            return
+
+        channel = member.guild.get_channel(channel)
+
+        # extends the alt score with the evasion points
+        logs = self.bot.get_cog('Logs')
+        alt_score = await logs.is_alt(member) if logs else 0
+        max_score = 5 + sum(POINTS.values())
+
+        evasion_embed = discord.Embed(
+            title='Possible Ban Evasion!',
+            color=discord.Color.blue()
+        )
+        evasion_embed.set_author(
+            name=member,
+            icon_url=member.avatar_url
+        )
+        evasion_embed.add_field(
+            name='User in Question',
+            value=member.mention,
+            inline=False
+        )
+        evasion_embed.add_field(
+            name='Banned Account',
+            value=f'<@{banned_id}> ({banned_id})',
+            inline=False
+        )
+        evasion_embed.add_field(
+            name='Matching',
+            value=', '.join(features),
+            inline=False
+        )
+        evasion_embed.add_field(
+            name=f'Score (0 through {max_score})',
+            value=alt_score + points,
+            inline=False
+        )
+        evasion_embed.set_footer(
+            text=f'Alt score {alt_score}/5 + evasion score {points}/' +
+            f'{max_score - 5}'
+        )
+
+        scheduler.low(
+            self.bot, ('message', channel.id), channel.send,
+            embed=evasion_embed
+        )
+
+
+def setup(bot):
+    """Adds the Evasion cog to the bot."""
+    bot.add_cog(Evasion(bot))
@@ -0,0 +1,350 @@
+"""Federation Cog, shares bans between every guild that opts in."""
+
+import asyncio
+from array import array
+from bisect import bisect_left
+import heapq
+import io
+import mmap
+import os
+
+import discord
+from discord.ext import commands
+
+from cogs import scheduler
+from cogs.cases import record
+from cogs.options import guild_options
+
+IDS_PATH = './data/federation.ids'  # sorted little-endian uint64
+BLOOM_PATH = './data/federation.bloom'
+PENDING_PATH = './data/federation.pending'  # bans not merged yet
+
+BLOOM_BYTES = 1 << 24  # 16 MiB, ~0.2% false positives at 10M IDs
+BLOOM_MASK = BLOOM_BYTES * 8 - 1
+BLOOM_HASHES = 7
+MASK_64 = (1 << 64) - 1
+MERGE_AT = 1000  # pending bans before they are merged into the file
+CHUNK = 65536  # IDs written per chunk
+UPLOAD_LIMIT = 8 * 1024 * 1024  # bytes, larger exports stay on disk
+
+
+def bloom_bits(user_id):
+    """Bit positions of a user ID, by double hashing."""
+    first = (user_id * 0x9E3779B97F4A7C15) & MASK_64
+    second = ((user_id ^ (user_id >> 31)) * 0xBF58476D1CE4E5B9) & MASK_64
+    second |= 1
+    return [
+        (first + i * second) & BLOOM_MASK for i in range(BLOOM_HASHES)
+    ]
+
+
+def map_file(path, size=None):
+    """Memory-maps a file, creating it first. Returns None if empty."""
+    if not os.path.exists(path):
+        with open(path, 'wb') as new_file:
+            if size:
+                new_file.truncate(size)
+
+    with open(path, 'r+b') as mapped_file:
+        if size and os.path.getsize(path) != size:
+            mapped_file.truncate(size)
+        if not os.path.getsize(path):
+            return None
+        return mmap.mmap(mapped_file.fileno(), 0)
+
+
+def merge_ids(old_ids, new_ids, path):
+    """
+    Writes the sorted union of two ID sequences to a file.
+
+    Streams in chunks, so memory use does not grow with the file.
+    Runs in a thread and returns the number of IDs written.
+    """
+    written = 0
+    last = None
+    chunk = array('Q')
+
+    with open(path, 'wb') as ids_file:
+        for user_id in heapq.merge(old_ids, new_ids):
+            if user_id == last:
+                continue
+            chunk.append(user_id)
+            last = user_id
+            if len(chunk) >= CHUNK:
+                written += len(chunk)
+                chunk.tofile(ids_file)
+                chunk = array('Q')
+        written += len(chunk)
+        chunk.tofile(ids_file)
+
+    return written
+
+
+def write_ids(ids_path, path):
+    """
+    Writes the IDs of the sorted ID file as text, one per line.
+
+    Runs in a thread and returns the number of IDs written.
+    """
+    written = 0
+
+    with open(ids_path, 'rb') as ids_file, open(path, 'w') as out_file:
+        while True:
+            chunk = array('Q')
+            try:
+                chunk.fromfile(ids_file, CHUNK)
+            except EOFError:
+                pass  # the last chunk is shorter
+            if not chunk:
+                break
+            out_file.writelines(f'{user_id}\n' for user_id in chunk)
+            written += len(chunk)
+
+    return written
+
+
+class Federation(commands.Cog):
+    """Shared blocklist of users banned in participating guilds."""
+    def __init__(self, bot):
+        self.bot = bot
+        fresh = not os.path.exists(BLOOM_PATH) or os.path.getsize(
+            BLOOM_PATH
+        ) != BLOOM_BYTES
+        self.bloom = map_file(BLOOM_PATH, BLOOM_BYTES)
+        self.ids_map = None
+        self.ids = ()
+        self.pending = set()
+        self.merging = None
+        self.remap()
+
+        if fresh:  # lost or resized, the ID file is still complete
+            for user_id in self.ids:
+                self.set_bits(user_id)
+
+        try:
+            with open(PENDING_PATH, 'r') as pending_file:
+                for line in pending_file:
+                    if line.strip().isdigit():
+                        self.add(int(line))
+        except FileNotFoundError:
+            pass
+
+    def cog_unload(self):
+        """Closes the memory maps, pending bans stay in the journal."""
+        if isinstance(self.ids, memoryview):
+            self.ids.release()
+        if self.ids_map:
+            self.ids_map.close()
+        self.bloom.close()
+
+    def remap(self):
+        """Maps the sorted ID file, called after each merge."""
+        old_map = self.ids_map
+        if isinstance(self.ids, memoryview):
+            self.ids.release()  # the map cannot close while exported
+        self.ids_map = map_file(IDS_PATH)
+        self.ids = memoryview(self.ids_map).cast('Q') if self.ids_map else ()
+
+        if old_map:
+            old_map.close()
+
+    def set_bits(self, user_id):
+        """Adds an ID to the Bloom filter."""
+        for bit in bloom_bits(user_id):
+            self.bloom[bit >> 3] |= 1 << (bit & 7)
+
+    def add(self, user_id):
+        """Adds an ID to the Bloom filter and the pending set."""
+        self.set_bits(user_id)
+        self.pending.add(user_id)
+
+    def __contains__(self, user_id):
+        for bit in bloom_bits(user_id):
+            if not self.bloom[bit >> 3] & (1 << (bit & 7)):
+                return False  # definitely not listed
+
+        if user_id in self.pending:
+            return True
+
+        i = bisect_left(self.ids, user_id)
+        return i < len(self.ids) and self.ids[i] == user_id
+
+    def __len__(self):
+        return len(self.ids) + len(self.pending)
+
+    def setting(self, guild):
+        """Returns the guild's federation setting: off, alert or ban."""
+        options = guild_options(self.bot, guild) or {}
+        return options.get('federation', 'off')
+
+    async def report(self, guild, user):
+        """Shares a ban, if the guild takes part in the federation."""
+        if self.setting(guild) == 'off' or user.id in self:
+            return
+
+        self.add(user.id)
+        with open(PENDING_PATH, 'a') as pending_file:
+            pending_file.write(f'{user.id}\n')
+
+        if len(self.pending) >= MERGE_AT:
+            await self.merge()
+
+    async def import_ids(self, lines):
+        """Adds IDs from text lines, returns how many were new."""
+        added = 0
+        for line in lines:
+            line = line.strip()
+            if line.isdigit() and int(line) not in self:
+                self.add(int(line))
+                added += 1
+
+                if added % CHUNK == 0:  # bounds the pending set
+                    await self.merge()
+
+        await self.merge()
+        return added
+
+    async def merge(self):
+        """Merges pending bans into the sorted file in a thread."""
+        if self.merging:
+            await self.merging
+            return
+
+        pending = sorted(self.pending)
+        if not pending:
+            return
+
+        loop = asyncio.get_running_loop()
+        self.merging = loop.run_in_executor(
+            None, merge_ids, self.ids, pending, IDS_PATH + '.tmp'
+        )
+        try:
+            await self.merging
+        finally:
+            self.merging = None
+
+        os.replace(IDS_PATH + '.tmp', IDS_PATH)
+        self.remap()
+
+        self.pending.difference_update(pending)
+        with open(PENDING_PATH, 'w') as pending_file:
+            pending_file.writelines(f'{user_id}\n' for user_id in self.pending)
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member):
+        """Bans or reports joiners on the shared blocklist."""
+        if member.id not in self:
+            return
+
+        guild = member.guild
+        setting = self.setting(guild)
+
+        if setting == 'ban':
+            await scheduler.high(
+                self.bot, ('ban', guild.id), guild.ban,
+                member, reason='Federated blocklist'
+            )
+            record(
+                self.bot, guild, 'ban', member, guild.me,
+                'Federated blocklist'
+            )
+        elif setting != 'alert':
+            return
+
+        channel = guild_options(self.bot, guild)['private_log']
+
+        if not channel:
+            return
+
+        channel = guild.get_channel(channel)
+
+        federation_embed = discord.Embed(
+            title='Federated Blocklist!',
+            description='This user was banned in another guild!',
+            color=discord.Color.blue()
+        )
+        federation_embed.set_author(
+            name=member,
+            icon_url=member.avatar_url
+        )
+        federation_embed.add_field(
+            name='User in Question',
+            value=member.mention,
+            inline=False
+        )
+        federation_embed.add_field(
+            name='Action',
+            value='Banned' if setting == 'ban' else 'None, please review!',
+            inline=False
+        )
+
+        scheduler.low(
+            self.bot, ('message', channel.id), channel.send,
+            embed=federation_embed
+        )
+
+    @commands.group(invoke_without_command=True)
+    async def federation(self, ctx):
+        """
+        Shows the shared blocklist. Enable it with `.settings federation`.
+
+        **Example:** `.federation`
+        """
+        await ctx.send(
+            f'The federated blocklist has **{len(self)}** users! ' +
+            f'This guild is set to `{self.setting(ctx.guild)}`.'
+        )
+
+    @federation.command(name='import')
+    @commands.is_owner()
+    async def import_(self, ctx, path=None):
+        """
+        Imports user IDs, one per line, from an attachment or a local file.
+
+        **Example:** `.federation import ./bans.txt`
+        """
+        if ctx.message.attachments:
+            data = await ctx.message.attachments[0].read()
+            added = await self.import_ids(io.StringIO(data.decode()))
+        elif path:
+            try:
+                with open(path, 'r') as import_file:
+                    added = await self.import_ids(import_file)
+            except OSError:
+                await ctx.send('Could not read that file!')
+                return
+        else:
+            await ctx.send('Please attach a file or give a path!')
+            return
+
+        await ctx.send(f'Imported **{added}** new users!')
+
+    @federation.command()
+    @commands.is_owner()
+    async def export(self, ctx, path):
+        """
+        Streams every user ID on the shared blocklist to a local file.
+
+        **Example:** `.federation export ./bans.txt`
+        """
+        await self.merge()
+
+        loop = asyncio.get_running_loop()
+        try:
+            count = await loop.run_in_executor(
+                None, write_ids, IDS_PATH, path
+            )
+        except OSError:
+            await ctx.send('Could not write that file!')
+            return
+
+        message = f'Exported **{count}** users to `{path}`!'
+        if os.path.getsize(path) <= UPLOAD_LIMIT:
+            await ctx.send(message, file=discord.File(path))
+        else:
+            await ctx.send(message)
+
+
+def setup(bot):
+    """Adds the Federation cog to the bot."""
+    bot.add_cog(Federation(bot))
@@ -1,18 +1,60 @@
 """Lockdown Cog, commands executed by the moderator to combat a raid."""
 
 import asyncio
+from datetime import datetime, timedelta
 import json
+import re
+import time
 
 import discord
 from discord.ext import commands
 
+from cogs import scheduler
+from cogs.members import chunked
+from cogs.options import guild_options
+
 CHANNELS_PATH = './data/channels.json'
+OPTIONS_PATH = './data/options.json'
+PURGE_CONCURRENCY = 5  # channels purged at the same time
+
+
+def raw_overwrites(channel):
+    """
+    Returns every overwrite of a channel, cached members or not.
+
+    `channel.overwrites` leaves out members missing from the cache, and
+    editing a channel with it would delete their overwrites.
+    """
+    overwrites = {}
+
+    for raw in channel._overwrites:
+        if raw.type == 'role':
+            target = channel.guild.get_role(raw.id)
+            if target is None:
+                continue
+        else:
+            target = discord.Object(raw.id)
+        overwrites[target] = channel.overwrites_for(target)
+
+    return overwrites
 
 
 class Lockdown(commands.Cog):
     """Moderator commands to combat a raid."""
     def __init__(self, bot):
         self.bot = bot
+        self.role_locks = {}  # guild_id -> lock around role creation
+
+    def set_option(self, guild, option, value):
+        """Writes a guild option and has the cache pick it up at once."""
+        with open(OPTIONS_PATH, 'r') as options_file:
+            options = json.load(options_file)
+
+        options[str(guild.id)][option] = value
+
+        with open(OPTIONS_PATH, 'w') as options_file:
+            json.dump(options, options_file, indent=2)
+        self.bot.get_cog('Options').reload()
 
     async def lock_channel(self, channel):
         """Function used to lock a channel."""
@@ -27,7 +69,7 @@ class Lockdown(commands.Cog):
             ow_dict[guild_key] = {}
         ow_dict[guild_key][channel_key] = {}
 
-        channel_ow = channel.overwrites
+        channel_ow = raw_overwrites(channel)
 
         if not channel_ow:  # empty dict
             target = channel.guild.default_role
@@ -48,7 +90,10 @@ class Lockdown(commands.Cog):
             overwrite.send_messages = False
             new_ow[target] = overwrite
 
-        await channel.edit(overwrites=new_ow)
+        await scheduler.high(
+            self.bot, ('channel', channel.id), channel.edit,
+            overwrites=new_ow
+        )
 
     async def unlock_channel(self, channel):
         """Function used to unlock a channel."""
@@ -65,12 +110,21 @@ class Lockdown(commands.Cog):
         for target_id, overwrite in ow_dict[guild_key][channel_key].items():
             target_id = int(target_id)
 
-            target = guild.get_role(target_id) or guild.get_member(target_id)
+            # members need not be cached, or even still in the guild
+            target = guild.get_role(target_id) or discord.Object(target_id)
 
             new_ow[target] = discord.PermissionOverwrite(**overwrite)
 
-        # Clears data from channels.json
-        ow_dict[guild_key].pop(channel_key)
+        # Unlocks channel
+        await scheduler.high(
+            self.bot, ('channel', channel.id), channel.edit, overwrites=new_ow
+        )
+
+        # Clears data from channels.json, once the channel is unlocked
+        with open(CHANNELS_PATH, 'r') as channels_file:
+            ow_dict = json.load(channels_file)
+
+        ow_dict[guild_key].pop(channel_key, None)
 
         if not ow_dict[guild_key]:  # guild_key dict is empty
             ow_dict.pop(guild_key)
@@ -78,8 +132,206 @@ class Lockdown(commands.Cog):
         with open(CHANNELS_PATH, 'w') as channels_file:
             json.dump(ow_dict, channels_file, indent=2)
 
-        # Unlocks channel
-        await channel.edit(overwrites=new_ow)
+    async def move_snapshot(self, guild, old_id, new_id):
+        """Moves saved overwrites to a recreated channel, keeps it locked."""
+        guild_key = str(guild.id)
+
+        with open(CHANNELS_PATH, 'r') as channels_file:
+            ow_dict = json.load(channels_file)
+
+        if str(old_id) not in ow_dict.get(guild_key, {}):
+            return False
+
+        ow_dict[guild_key][str(new_id)] = ow_dict[guild_key].pop(str(old_id))
+
+        with open(CHANNELS_PATH, 'w') as channels_file:
+            json.dump(ow_dict, channels_file, indent=2)
+
+        return True
+
+    def reconcile_locks(self, guilds):
+        """
+        Compares saved lock snapshots with the cached channel overwrites.
+
+        Snapshots of deleted channels, and of channels unlocked by hand or
+        by an interrupted `lockall`, are dropped. Partly unlocked channels
+        are flagged. Returns `(checked, repaired, flagged channels)`.
+        """
+        with open(CHANNELS_PATH, 'r') as channels_file:
+            ow_dict = json.load(channels_file)
+
+        checked = repaired = 0
+        flagged = []
+
+        for guild in guilds:
+            snapshots = ow_dict.get(str(guild.id), {})
+
+            for channel_key, saved in list(snapshots.items()):
+                checked += 1
+                channel = guild.get_channel(int(channel_key))
+
+                if channel is None:
+                    del snapshots[channel_key]
+                    repaired += 1
+                    continue
+
+                # raw overwrites, members do not need to be cached
+                live = {
+                    target_key: channel.overwrites_for(
+                        discord.Object(int(target_key))
+                    )
+                    for target_key in saved
+                }
+                gone = [
+                    target_key for target_key, overwrite in live.items()
+                    if overwrite.is_empty()  # deleted role or member
+                ]
+                unlocked = [
+                    target_key for target_key, overwrite in live.items()
+                    if overwrite.send_messages is not False
+                    and target_key not in gone
+                ]
+
+                for target_key in gone:
+                    del saved[target_key]
+
+                if len(unlocked) == len(saved):
+                    del snapshots[channel_key]
+                    repaired += 1
+                elif unlocked:
+                    flagged.append(channel)
+                elif gone:
+                    repaired += 1
+
+            if not snapshots:
+                ow_dict.pop(str(guild.id), None)
+
+        if repaired:
+            with open(CHANNELS_PATH, 'w') as channels_file:
+                json.dump(ow_dict, channels_file, indent=2)
+
+        return checked, repaired, flagged
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        """Reconciles the saved locks of every guild at startup."""
+        start = time.perf_counter()
+        checked, repaired, flagged = self.reconcile_locks(self.bot.guilds)
+        took = (time.perf_counter() - start) * 1000
+
+        print(
+            f'Reconciled {checked} locked channels in {took:.1f} ms: ' +
+            f'{repaired} repaired, {len(flagged)} flagged ' +
+            f'{[channel.id for channel in flagged]}'
+        )
+
+    async def create_quarantine_role(self, guild):
+        """Create a role that can read but not talk in any channel."""
+        quarantine_role = await guild.create_role(
+            name='Quarantine',
+            color=discord.Color.dark_gray(),
+            reason='No quarantine role detected, so I automatically made one!'
+        )
+
+        # one overwrite per channel, all channels at once
+        await asyncio.gather(*(
+            scheduler.high(
+                self.bot, ('channel', channel.id), channel.set_permissions,
+                quarantine_role, send_messages=False, add_reactions=False,
+                speak=False, reason='Quarantine role set up'
+            )
+            for channel in guild.channels
+        ), return_exceptions=True)
+
+        return quarantine_role
+
+    async def get_quarantine_role(self, guild):
+        """Returns the quarantine role, creating it the first time."""
+        options = guild_options(self.bot, guild) or {}
+        quarantine_role = guild.get_role(options.get('quarantine_role'))
+
+        if quarantine_role:
+            return quarantine_role
+
+        # joiners arriving together must not each create a role
+        async with self.role_locks.setdefault(guild.id, asyncio.Lock()):
+            options = guild_options(self.bot, guild) or {}
+            quarantine_role = guild.get_role(options.get('quarantine_role'))
+
+            if not quarantine_role:
+                await self.bot.get_cog('Options').add_guild(guild)
+                quarantine_role = await self.create_quarantine_role(guild)
+                self.set_option(guild, 'quarantine_role', quarantine_role.id)
+
+        return quarantine_role
+
+    async def quarantine_members(self, guild, members):
+        """Gives the quarantine role to members, one API call each."""
+        quarantine_role = await self.get_quarantine_role(guild)
+        results = await asyncio.gather(*(
+            scheduler.high(
+                self.bot, ('member', guild.id), member.add_roles,
+                quarantine_role, reason='Quarantined'
+            )
+            for member in members
+        ), return_exceptions=True)
+        return sum(1 for result in results if result is None)
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member):
+        """Quarantines joiners while quarantine mode is on."""
+        options = guild_options(self.bot, member.guild) or {}
+
+        if options.get('quarantine'):
+            await self.quarantine_members(member.guild, [member])
+
+    @commands.command()
+    async def quarantine(self, ctx, mode=None):
+        """
+        Gives every new joiner the quarantine role, or stops doing so.
+
+        **Example:** `.quarantine on`
+        """
+        await self.bot.get_cog('Options').add_guild(ctx.guild)
+        active = guild_options(self.bot, ctx.guild).get('quarantine', False)
+
+        if mode is None:
+            state = 'on' if active else 'off'
+            await ctx.send(f'Quarantine mode is **{state}**!')
+            return
+        if mode.lower() not in ('on', 'off'):
+            await ctx.send('Mode must be `on` or `off`!')
+            return
+
+        if mode.lower() == 'on':
+            await self.get_quarantine_role(ctx.guild)  # sets the role up
+
+        self.set_option(ctx.guild, 'quarantine', mode.lower() == 'on')
+
+        await ctx.send(f'Quarantine mode is now **{mode.lower()}**!')
+
+    @commands.command()
+    async def release(self, ctx, members: commands.Greedy[discord.Member]):
+        """
+        Releases members from quarantine, or everyone if none are given.
+
+        **Example:** `.release @ACPlayGames`
+        """
+        quarantine_role = await self.get_quarantine_role(ctx.guild)
+        if not members:
+            await chunked(self.bot, ctx.guild)
+            members = quarantine_role.members
+
+        results = await asyncio.gather(*(
+            scheduler.high(
+                self.bot, ('member', ctx.guild.id), member.remove_roles,
+                quarantine_role, reason='Released from quarantine'
+            )
+            for member in members
+        ), return_exceptions=True)
+
+        released = sum(1 for result in results if result is None)
+        await ctx.send(f'Released **{released}** members from quarantine!')
 
     @commands.command()
     async def lock(self, ctx, channel: discord.TextChannel = None):
@@ -117,7 +369,7 @@ class Lockdown(commands.Cog):
         with open(CHANNELS_PATH, 'r') as channels_file:
             ow_dict = json.load(channels_file)
 
-        if channel_key not in ow_dict[guild_key]:
+        if channel_key not in ow_dict.get(guild_key, {}):
             await ctx.send('This channel is not locked!')
         else:
             await self.unlock_channel(channel)
@@ -148,8 +400,10 @@ class Lockdown(commands.Cog):
 
             if channel_key not in ow_dict[guild_key]:
                 await self.lock_channel(channel)
-                await ctx.send(f'{channel.mention} has been locked!')
-                await asyncio.sleep(1)
+                scheduler.low(
+                    self.bot, ('message', ctx.channel.id), ctx.send,
+                    f'{channel.mention} has been locked!'
+                )
 
     @commands.command()
     async def unlockall(self, ctx):
@@ -162,11 +416,46 @@ class Lockdown(commands.Cog):
         for channel in ctx.guild.text_channels:
             channel_key = str(channel.id)
 
-            if channel_key not in ow_dict[guild_key]:
+            if channel_key not in ow_dict.get(guild_key, {}):
                 continue
             await self.unlock_channel(channel)
-            await ctx.send(f'{channel.mention} has been unlocked!')
-            await asyncio.sleep(1)
+            scheduler.low(
+                self.bot, ('message', ctx.channel.id), ctx.send,
+                f'{channel.mention} has been unlocked!'
+            )
+
+    @commands.command()
+    @commands.cooldown(1, 10, commands.BucketType.guild)
+    async def lockcheck(self, ctx):
+        """
+        Checks the saved locks against the channels, repairs stale ones.
+
+        **Example:** `.lockcheck`
+        """
+        start = time.perf_counter()
+        checked, repaired, flagged = self.reconcile_locks([ctx.guild])
+        took = (time.perf_counter() - start) * 1000
+
+        lockcheck_embed = discord.Embed(
+            title='Lock Check',
+            description=f'Checked **{checked}** locked channels in ' +
+            f'**{took:.1f}** ms!',
+            color=discord.Color.blue()
+        )
+        lockcheck_embed.add_field(
+            name='Repaired',
+            value=repaired,
+            inline=False
+        )
+        lockcheck_embed.add_field(
+            name='Partly Unlocked, Please Review',
+            value=' '.join(
+                channel.mention for channel in flagged
+            )[:1024] or 'None',
+            inline=False
+        )
+
+        await ctx.send(embed=lockcheck_embed)
 
     @commands.command()
     @commands.cooldown(1, 3, commands.BucketType.member)
@@ -193,6 +482,107 @@ class Lockdown(commands.Cog):
         else:
             await ctx.send('Invalid number of messages to purge!')
 
+    async def recent_joiners(self, guild, minutes):
+        """IDs of members who joined in the last minutes, even if gone."""
+        await chunked(self.bot, guild)
+        cutoff = datetime.utcnow() - timedelta(minutes=minutes)
+        authors = {
+            member.id for member in guild.members
+            if member.joined_at and member.joined_at >= cutoff
+        }
+
+        # joiners that already left are still in the Logs index
+        logs = self.bot.get_cog('Logs')
+        if logs and guild.id in logs.creation:
+            since = time.time() - minutes * 60
+            authors.update(
+                member_id
+                for joined, _, member_id in logs.creation[guild.id].joins
+                if joined >= since
+            )
+
+        return authors
+
+    @commands.command()
+    @commands.cooldown(1, 30, commands.BucketType.guild)
+    async def raidpurge(self, ctx, minutes: int, joined: int = 0, *,
+                        pattern=None):
+        """
+        Deletes recent messages in every channel, with optional filters.
+
+        Only messages from the last `minutes` are deleted. If `joined` is
+        set, only authors who joined in the last `joined` minutes count.
+        The optional `pattern` is a regular expression.
+        **Example:** `.raidpurge 30 60 discord\\.gg`
+        """
+        if not 1 <= minutes <= 20160 or joined < 0:  # bulk delete, 14 days
+            await ctx.send('Minutes must be between `1` and `20160`!')
+            return
+
+        try:
+            regex = re.compile(pattern, re.IGNORECASE) if pattern else None
+        except re.error:
+            await ctx.send('Please input a valid pattern!')
+            return
+
+        authors = None
+        if joined:
+            authors = await self.recent_joiners(ctx.guild, joined)
+
+        def check(message):
+            if message.id == ctx.message.id:
+                return False
+            if authors is not None and message.author.id not in authors:
+                return False
+            if regex and not regex.search(message.content):
+                return False
+            return True
+
+        after = datetime.utcnow() - timedelta(minutes=minutes)
+        limiter = asyncio.Semaphore(PURGE_CONCURRENCY)
+        me = ctx.guild.me
+
+        async def purge_channel(channel):
+            # 100-message bulk deletes, paced by the library's rate limits
+            async with limiter:
+                try:
+                    deleted = await channel.purge(
+                        limit=None, after=after, check=check, bulk=True
+                    )
+                except discord.HTTPException:
+                    return channel, 0
+                return channel, len(deleted)
+
+        channels = [
+            channel for channel in ctx.guild.text_channels
+            if channel.permissions_for(me).manage_messages
+        ]
+        results = await asyncio.gather(*map(purge_channel, channels))
+        results = sorted(
+            (result for result in results if result[1]),
+            key=lambda result: result[1],
+            reverse=True
+        )
+        total = sum(count for _, count in results)
+
+        purge_embed = discord.Embed(
+            title='Raid Purge',
+            description=f'Deleted {total} messages in {len(results)} ' +
+            'channels!',
+            color=discord.Color.blue()
+        )
+        if results:
+            purge_embed.add_field(
+                name='Channels',
+                value='\n'.join(
+                    f'{channel.mention}: {count}'
+                    for channel, count in results[:20]
+                ),
+                inline=False
+            )
+
+        await ctx.send(embed=purge_embed)
+
     @commands.command()
     @commands.cooldown(1, 3, commands.BucketType.member)
     async def slowmode(self, ctx, seconds: int):
@@ -203,7 +593,10 @@ class Lockdown(commands.Cog):
         """
         await ctx.message.delete()
         if 0 <= seconds <= 21600:
-            await ctx.channel.edit(slowmode_delay=seconds)
+            await scheduler.high(
+                self.bot, ('channel', ctx.channel.id), ctx.channel.edit,
+                slowmode_delay=seconds
+            )
 
             if seconds == 1:
                 await ctx.send('Slowmode set to 1 second!')
@@ -1,18 +1,159 @@
 """Logs Cog, detects deleted and edited messages."""
 
-from datetime import datetime
-import json
+import asyncio
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+from datetime import datetime, timedelta
+from difflib import SequenceMatcher
+import time
 
 import discord
 from discord.ext import commands
 
-OPTIONS_PATH = './data/options.json'
+from cogs import scheduler
+from cogs.members import CachedUser, chunked
+from cogs.options import guild_options
+
+SCAN_CHUNK = 1000  # members per analysis job
+SCAN_LISTED = 20  # suspects shown in the scan embed
+JOIN_WINDOW = 86400  # seconds a joiner stays in the creation index
+BATCH_SPAN = 5 * 60 * 1000  # ms, accounts this close were made together
+BATCH_ALERT = 5  # joiners created within BATCH_SPAN before flagging
+CREATED_LISTED = 40  # members shown by the created command
+EDIT_DEBOUNCE = 5  # seconds of edits to one message logged together
+EDIT_CONTEXT = 3  # unchanged words kept around each change
+
+
+def alt_score(created_at, has_avatar, has_flags, now):
+    """Scores an account from 0 to 5, see `Logs.is_alt`."""
+    score = 0
+
+    if (now - created_at).days <= 7:  # created within a week ago
+        score += 3
+    if not has_avatar:  # default avatar
+        score += 1
+    if not has_flags:
+        score += 1
+
+    return score
+
+
+def score_batch(rows):
+    """
+    Scores many accounts at once, safe to run in a worker process.
+
+    Each row is `(user_id, created_at, has_avatar, has_flags)`.
+    """
+    now = datetime.utcnow()
+    return [(row[0], alt_score(*row[1:], now)) for row in rows]
+
+
+def word_diff(before, after):
+    """
+    Word-level diff of two texts, None if the words are the same.
+
+    Removed words are struck out, added words are bold and long runs of
+    unchanged words are shortened to `EDIT_CONTEXT` words either side.
+    """
+    old, new = before.split(), after.split()
+    if old == new:
+        return None
+
+    escape = discord.utils.escape_markdown
+    parts = []
+    matcher = SequenceMatcher(None, old, new, autojunk=False)
+
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            words = old[i1:i2]
+            head = words[:EDIT_CONTEXT] if i1 else []
+            tail = words[-EDIT_CONTEXT:] if i2 < len(old) else []
+            if len(words) > len(head) + len(tail) + 1:
+                words = head + ['...'] + tail
+            parts.extend(escape(word) for word in words)
+            continue
+        if i2 > i1:
+            parts.append('~~' + escape(' '.join(old[i1:i2])) + '~~')
+        if j2 > j1:
+            parts.append('**' + escape(' '.join(new[j1:j2])) + '**')
+
+    diff = ' '.join(parts)
+    return diff if len(diff) <= 1024 else diff[:1021] + '...'
+
+
+def created_ms(user_id):
+    """Account creation time in ms, read straight from the snowflake."""
+    return (user_id >> 22) + discord.utils.DISCORD_EPOCH
+
+
+class CreationIndex:
+    """Sorted creation times of a guild's joiners over a rolling window."""
+    def __init__(self):
+        self.joins = deque()  # (joined, created, member_id), oldest first
+        self.created = []  # sorted (created, member_id)
+        self.alerts = []  # [created_lo, created_hi, message]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['alerts'] = []  # messages are not kept across restarts
+        return state
+
+    def expire(self, now):
+        """Drops joiners that have fallen out of the window."""
+        while self.joins and now - self.joins[0][0] > JOIN_WINDOW:
+            _, created, member_id = self.joins.popleft()
+            i = bisect_left(self.created, (created, member_id))
+            if i < len(self.created) and self.created[i][1] == member_id:
+                del self.created[i]
+
+        if not self.joins:
+            self.alerts = []
+
+    def insert(self, member_id, now):
+        """Adds a joiner and returns how many joiners were created nearby."""
+        self.expire(now)
+
+        created = created_ms(member_id)
+        i = bisect_left(self.created, (created, member_id))
+        if i < len(self.created) and self.created[i][1] == member_id:
+            # rejoined within the window, counted once from the last join
+            del self.created[i]
+            self.joins = deque(
+                join for join in self.joins if join[2] != member_id
+            )
+
+        self.joins.append((now, created, member_id))
+        insort(self.created, (created, member_id))
+
+        return self.count(created - BATCH_SPAN, created + BATCH_SPAN)
+
+    def count(self, start, end):
+        """Counts joiners created between two times (ms), inclusive."""
+        lower = bisect_left(self.created, (start,))
+        upper = bisect_right(self.created, (end, float('inf')))
+        return upper - lower
+
+    def between(self, start, end):
+        """Lists the IDs of joiners created between two times (ms)."""
+        lower = bisect_left(self.created, (start,))
+        upper = bisect_right(self.created, (end, float('inf')))
+        return [member_id for _, member_id in self.created[lower:upper]]
 
 
 class Logs(commands.Cog):
     """Detects deleted and edited messages."""
     def __init__(self, bot):
         self.bot = bot
+        self.creation = {}  # guild_id -> CreationIndex
+        self.edits = {}  # message_id -> [content before, latest message]
+
+    def snapshot_state(self):
+        """Joiner creation times kept across restarts."""
+        return self.creation
+
+    def restore_state(self, state):
+        """Resumes the creation indexes from before the restart."""
+        self.creation.update(state)
 
     async def is_alt(self, user: discord.User):
         """
@@ -23,22 +164,16 @@ class Logs(commands.Cog):
         A score of 2-3 means the user may or may not be an alt.
         A score of 4-5 means the user is very likely to be an alt.
         """
-        score = 0
-
-        age = datetime.utcnow() - user.created_at
-
-        if age.days <= 7:  # created within a week ago
-            score += 3
-        if user.avatar is None:  # default avatar
-            score += 1
-        if not user.public_flags.all():
-            score += 1
-
-        return score
+        return alt_score(
+            user.created_at,
+            user.avatar is not None,
+            bool(user.public_flags.value),
+            datetime.utcnow()
+        )
 
     @commands.command()
     @commands.cooldown(1, 1, commands.BucketType.member)
-    async def check(self, ctx, user: discord.User):
+    async def check(self, ctx, user: CachedUser):
         """
         Checks if a user is an alt.
 
@@ -72,22 +207,174 @@ class Logs(commands.Cog):
             alt_embed.set_footer(text=alt_footer)
             await ctx.send(embed=alt_embed)
 
+    @commands.command()
+    @commands.cooldown(1, 60, commands.BucketType.guild)
+    async def scan(self, ctx):
+        """Checks every member of the guild for alts."""
+        await chunked(self.bot, ctx.guild)
+        rows = [
+            (
+                member.id,
+                member.created_at,
+                member.avatar is not None,
+                bool(member.public_flags.value)
+            )
+            for member in ctx.guild.members if not member.bot
+        ]
+        chunks = [
+            rows[i:i + SCAN_CHUNK] for i in range(0, len(rows), SCAN_CHUNK)
+        ]
+
+        analysis = self.bot.get_cog('Analysis')
+        if analysis:
+            results = await asyncio.gather(*(
+                analysis.submit(score_batch, ctx.guild.id, chunk)
+                for chunk in chunks
+            ))
+        else:
+            results = [score_batch(chunk) for chunk in chunks]
+
+        scores = [score for result in results for score in result]
+        safe = sum(1 for _, score in scores if score <= 1)
+        caution = sum(1 for _, score in scores if 2 <= score <= 3)
+        suspects = [user_id for user_id, score in scores if score >= 4]
+
+        scan_embed = discord.Embed(
+            title='Scan',
+            description=f'Scanned {len(scores)} members!',
+            color=discord.Color.blue()
+        )
+        scan_embed.add_field(name='Safe', value=safe)
+        scan_embed.add_field(name='Caution', value=caution)
+        scan_embed.add_field(name='Alt', value=len(suspects))
+        if suspects:
+            listed = ' '.join(
+                f'<@{user_id}>' for user_id in suspects[:SCAN_LISTED]
+            )
+            if len(suspects) > SCAN_LISTED:
+                listed += f' and {len(suspects) - SCAN_LISTED} more'
+            scan_embed.add_field(
+                name='Most Likely Alts',
+                value=listed,
+                inline=False
+            )
+        scan_embed.set_footer(text='0-1: safe; 2-3: caution; 4-5: alt')
+
+        await ctx.send(embed=scan_embed)
+
+    @commands.command()
+    @commands.cooldown(1, 3, commands.BucketType.member)
+    async def created(self, ctx, day, clock, minutes: int = 10):
+        """
+        Lists members whose accounts were created in a time window (UTC).
+
+        **Example:** `.created 2021-01-31 18:30 15`
+        """
+        try:
+            start = datetime.strptime(f'{day} {clock}', '%Y-%m-%d %H:%M')
+        except ValueError:
+            await ctx.send('Please use the format `YYYY-MM-DD HH:MM`!')
+            return
+        if not 1 <= minutes <= 1440:
+            await ctx.send('Minutes must be between `1` and `1440`!')
+            return
+
+        end = start + timedelta(minutes=minutes)
+        await chunked(self.bot, ctx.guild)
+        members = sorted(
+            (member for member in ctx.guild.members
+             if start <= member.created_at < end),
+            key=lambda member: member.created_at
+        )
+
+        listed = '\n'.join(
+            f'{member.mention} `{member.created_at:%H:%M:%S}`'
+            for member in members[:CREATED_LISTED]
+        )
+        if len(members) > CREATED_LISTED:
+            listed += f'\nand {len(members) - CREATED_LISTED} more'
+
+        created_embed = discord.Embed(
+            title='Created',
+            description=f'{len(members)} members were created between ' +
+            f'`{start:%Y-%m-%d %H:%M}` and `{end:%H:%M}`!',
+            color=discord.Color.blue()
+        )
+        if members:
+            created_embed.add_field(
+                name='Members',
+                value=listed,
+                inline=False
+            )
+
+        await ctx.send(embed=created_embed)
+
+    async def flag_batch(self, channel, index, member):
+        """Reports joiners created in the same few minutes, once per batch."""
+        created = created_ms(member.id)
+        start, end = created - BATCH_SPAN, created + BATCH_SPAN
+        member_ids = index.between(start, end)
+
+        for alert in index.alerts:
+            if alert[0] <= end and start <= alert[1]:  # overlapping batch
+                alert[0] = min(alert[0], start)
+                alert[1] = max(alert[1], end)
+                member_ids = index.between(alert[0], alert[1])
+                break
+        else:
+            alert = [start, end, None]
+            index.alerts.append(alert)
+
+        listed = ' '.join(
+            f'<@{member_id}>' for member_id in member_ids[:CREATED_LISTED]
+        )
+        if len(member_ids) > CREATED_LISTED:
+            listed += f' and {len(member_ids) - CREATED_LISTED} more'
+
+        batch_embed = discord.Embed(
+            title='Account Batch!',
+            description=f'{len(member_ids)} recent joiners were created ' +
+            'within minutes of each other!',
+            color=discord.Color.blue()
+        )
+        batch_embed.add_field(
+            name='Created Around',
+            value=f'{member.created_at:%Y-%m-%d %H:%M} UTC',
+            inline=False
+        )
+        batch_embed.add_field(
+            name='Members',
+            value=listed,
+            inline=False
+        )
+
+        if alert[2]:
+            try:
+                await scheduler.low(
+                    self.bot, ('message', channel.id), alert[2].edit,
+                    embed=batch_embed, merge_key=alert[2].id
+                )
+                return
+            except discord.NotFound:
+                pass
+
+        alert[2] = await scheduler.low(
+            self.bot, ('message', channel.id), channel.send, embed=batch_embed
+        )
+
     @commands.Cog.listener()
     async def on_message_delete(self, message):
         """Calls when a message is deleted in the cache."""
         # checks for the private_log channel
-        with open(OPTIONS_PATH, 'r') as options_file:
-            options = json.load(options_file)
-
         if not message.guild:
             return
 
-        guild_key = str(message.guild.id)
+        options = guild_options(self.bot, message.guild)
 
-        if guild_key not in options:
+        if options is None:
             return
 
-        channel = options[guild_key]['private_log']
+        channel = options['private_log']
 
         if not channel:
             return
@@ -114,27 +401,49 @@ class Logs(commands.Cog):
             inline=False
         )
 
-        await channel.send(embed=delete_embed)
+        scheduler.low(
+            self.bot, ('message', channel.id), channel.send, embed=delete_embed
+        )
 
     @commands.Cog.listener()
     async def on_message_edit(self, before, after):
         """Calls when a message is edited in the cache."""
-        # checks for the private_log channel
-        with open(OPTIONS_PATH, 'r') as options_file:
-            options = json.load(options_file)
-
         if not after.guild:
             return
 
+        if before.content == after.content:  # embeds unfurling, pins
+            return
+
         if not(before.content and after.content):  # message empty
             return
 
-        guild_key = str(after.guild.id)
+        # a burst of edits to one message is logged once
+        pending = self.edits.get(after.id)
+        if pending:
+            pending[1] = after
+            return
+
+        self.edits[after.id] = [before.content, after]
+        asyncio.get_running_loop().call_later(
+            EDIT_DEBOUNCE, lambda: asyncio.ensure_future(
+                self.log_edit(*self.edits.pop(after.id))
+            )
+        )
+
+    async def log_edit(self, before_content, after):
+        """Logs the difference between the first and last version."""
+        diff = word_diff(before_content, after.content)
 
-        if guild_key not in options:
+        if not diff:  # edited back, or whitespace only
             return
 
-        channel = options[guild_key]['private_log']
+        # checks for the private_log channel
+        options = guild_options(self.bot, after.guild)
+
+        if options is None:
+            return
+
+        channel = options['private_log']
 
         if not channel:
             return
@@ -151,39 +460,37 @@ class Logs(commands.Cog):
             icon_url=after.author.avatar_url
         )
         edit_embed.add_field(
-            name='Message Before',
-            value=before.content,
-            inline=False
-        )
-        edit_embed.add_field(
-            name='Message After',
-            value=after.content,
+            name='Changes',
+            value=diff,
             inline=False
         )
         edit_embed.add_field(
             name='Channel',
-            value=after.channel.mention,
+            value=f'{after.channel.mention}, [here]({after.jump_url})',
             inline=False
         )
 
-        await channel.send(embed=edit_embed)
+        scheduler.low(
+            self.bot, ('message', channel.id), channel.send, embed=edit_embed
+        )
 
     @commands.Cog.listener()
     async def on_member_join(self, member):
         """Automatically flag any suspicious members."""
-        # checks for the private_log channel
-        with open(OPTIONS_PATH, 'r') as options_file:
-            options = json.load(options_file)
-
         if not member.guild:
             return
 
-        guild_key = str(member.guild.id)
+        # indexes the account creation time, O(log n) search
+        index = self.creation.setdefault(member.guild.id, CreationIndex())
+        nearby = index.insert(member.id, time.time())
 
-        if guild_key not in options:
+        # checks for the private_log channel
+        options = guild_options(self.bot, member.guild)
+
+        if options is None:
             return
 
-        channel = options[guild_key]['private_log']
+        channel = options['private_log']
 
         if not channel:
             return
@@ -216,7 +523,14 @@ class Logs(commands.Cog):
                 text='0-1: safe; 2-3: caution; 4-5: alt'
             )
 
-            await channel.send(embed=check_embed)
+            scheduler.low(
+                self.bot, ('message', channel.id), channel.send,
+                embed=check_embed
+            )
+
+        # checks if the joiner was created in a batch with others
+        if nearby >= BATCH_ALERT:
+            await self.flag_batch(channel, index, member)
 
 
 def setup(bot):
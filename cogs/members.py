@@ -0,0 +1,179 @@
+"""Members Cog, keeps the member cache small for large guilds."""
+
+import asyncio
+from collections import OrderedDict
+import re
+import time
+
+import discord
+from discord.ext import commands
+
+QUERY_LIMIT = 100  # user IDs per gateway member query
+USER_CACHE_SIZE = 10000  # users kept, least recently used out
+USER_TTL = 600  # seconds a fetched user is trusted
+UNKNOWN_TTL = 60  # seconds an unknown ID is remembered
+USER_ID = re.compile(r'(?:<@!?)?(\d{15,21})>?$')
+
+
+class UserCache:
+    """LRU cache of looked up users with a TTL, unknown IDs included."""
+    def __init__(self):
+        self.users = OrderedDict()  # user_id -> (expires, user or None)
+        self.hits = 0
+        self.unknown_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id):
+        """Returns `(found, user)`, the user is None for unknown IDs."""
+        entry = self.users.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            self.users.pop(user_id, None)
+            self.misses += 1
+            return False, None
+
+        self.users.move_to_end(user_id)
+        if entry[1] is None:
+            self.unknown_hits += 1
+        else:
+            self.hits += 1
+        return True, entry[1]
+
+    def put(self, user_id, user):
+        """Caches a user, or None for an unknown ID."""
+        ttl = USER_TTL if user else UNKNOWN_TTL
+        self.users[user_id] = (time.monotonic() + ttl, user)
+        self.users.move_to_end(user_id)
+
+        while len(self.users) > USER_CACHE_SIZE:
+            self.users.popitem(last=False)
+            self.evictions += 1
+
+    def hit_rate(self):
+        """Share of lookups answered without the API, 0 to 1."""
+        lookups = self.hits + self.unknown_hits + self.misses
+        return (self.hits + self.unknown_hits) / lookups if lookups else 0
+
+
+class Members(commands.Cog):
+    """Loads guild members on demand instead of at startup."""
+    def __init__(self, bot):
+        self.bot = bot
+        self.chunking = {}  # guild_id -> chunk task
+        self.users = UserCache()
+        self.fetching = {}  # user_id -> fetch task
+
+    async def user(self, user_id):
+        """Looks a user up, None if the ID is unknown to Discord."""
+        found, user = self.users.get(user_id)
+        if found:
+            return user
+
+        user = self.bot.get_user(user_id)
+        if user is None:
+            task = self.fetching.get(user_id)
+            if task is None:  # one fetch, however many commands wait
+                task = asyncio.ensure_future(self.fetch_user(user_id))
+                self.fetching[user_id] = task
+                task.add_done_callback(
+                    lambda _: self.fetching.pop(user_id, None)
+                )
+            user = await asyncio.shield(task)
+
+        self.users.put(user_id, user)
+        return user
+
+    async def fetch_user(self, user_id):
+        """Fetches a user from the API, None if not found."""
+        try:
+            return await self.bot.fetch_user(user_id)
+        except discord.NotFound:
+            return None
+
+    async def chunk(self, guild):
+        """Chunks a guild the first time a command needs every member."""
+        if guild.chunked:
+            return
+
+        task = self.chunking.get(guild.id)
+        if task is None:  # one request, however many commands wait
+            task = asyncio.ensure_future(guild.chunk(cache=True))
+            self.chunking[guild.id] = task
+            task.add_done_callback(
+                lambda _: self.chunking.pop(guild.id, None)
+            )
+
+        await asyncio.shield(task)
+
+    @commands.Cog.listener()
+    async def on_guild_available(self, guild):
+        """Caches muted members, joiners and role changes cache themselves."""
+        moderation = self.bot.get_cog('Moderation')
+        if moderation is None:
+            return
+
+        if not guild.chunked:
+            user_ids = list(moderation.mutes.get(guild.id, ()))
+
+            for i in range(0, len(user_ids), QUERY_LIMIT):
+                await guild.query_members(
+                    user_ids=user_ids[i:i + QUERY_LIMIT], cache=True
+                )
+
+        # the cached muted members can now be checked
+        await moderation.reconcile_mutes(guild)
+
+    @commands.command()
+    @commands.is_owner()
+    async def usercache(self, ctx):
+        """
+        Shows how well the user lookup cache works (Owner only!)
+
+        **Example:** `.usercache`
+        """
+        users = self.users
+        await ctx.send(
+            f'**{len(users.users)}** users cached, ' +
+            f'**{users.hit_rate():.1%}** hit rate: ' +
+            f'`{users.hits}` hits, `{users.unknown_hits}` unknown ID hits, ' +
+            f'`{users.misses}` misses, `{users.evictions}` evictions.'
+        )
+
+
+async def lookup_user(bot, user_id):
+    """Looks a user up through the cache, None if the ID is unknown."""
+    members = bot.get_cog('Members')
+    if members:
+        return await members.user(user_id)
+
+    try:
+        return await bot.fetch_user(user_id)
+    except discord.NotFound:
+        return None
+
+
+class CachedUser(commands.Converter):
+    """`UserConverter` that looks up IDs and mentions through the cache."""
+    async def convert(self, ctx, argument):
+        match = USER_ID.match(argument)
+        if match is None:  # name#discriminator, searched locally
+            return await commands.UserConverter().convert(ctx, argument)
+
+        user = await lookup_user(ctx.bot, int(match.group(1)))
+        if user is None:
+            raise commands.UserNotFound(argument)
+        return user
+
+
+async def chunked(bot, guild):
+    """Makes sure every member of a guild is cached."""
+    members = bot.get_cog('Members')
+    if members:
+        await members.chunk(guild)
+    elif not guild.chunked:
+        await guild.chunk(cache=True)
+
+
+def setup(bot):
+    """Adds the Members cog to the bot."""
+    bot.add_cog(Members(bot))
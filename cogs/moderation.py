@@ -1,21 +1,250 @@
 """Moderation Cog, typical moderation commands."""
 
+import asyncio
+from collections import OrderedDict, deque
 import json
+import time
 
 import discord
 from discord.ext import commands
 
+from cogs import scheduler
+from cogs.cases import record
+from cogs.members import CachedUser, lookup_user
+from cogs.options import guild_options
+
 DEFAULT_REASON = 'No reason was provided.'
 OPTIONS_PATH = './data/options.json'
 WARNS_PATH = './data/warns.json'
 MUTES_PATH = './data/mutes.json'
 VALID_USER = 'Please provide a valid user!'
 
+REPORT_WINDOW = 600  # seconds reports on one user share an embed
+REPORT_FLOOD = 5  # new report embeds allowed per guild per minute
+REPORT_LISTED = 10  # reports linked in one embed
+WARNS_PER_PAGE = 10
+WARN_PAGES_CACHED = 256  # rendered warnings pages kept, least recent out
+PAGE_TIMEOUT = 60  # seconds the page reactions stay active
+PAGE_REACTIONS = ('\u25c0\ufe0f', '\u25b6\ufe0f')  # previous, next
+
+
+def limited(lines, limit=1024):
+    """Joins lines, leaving out the ones past an embed field's limit."""
+    value = ''
+    for i, line in enumerate(lines):
+        if len(value) + len(line) + 20 > limit:
+            return value + f'and {len(lines) - i} more'
+        value += line + '\n'
+    return value or 'None'
+
+
+class ReportThread:
+    """Reports on one user, or on many users once a guild is flooded."""
+    def __init__(self, accused, now):
+        self.accused = accused  # None for a flooded guild's overflow
+        self.started = now
+        self.reports = {}  # (reporter_id, accused_id) -> report
+        self.message = None  # future of the embed message
+
+    def add(self, reporter, accused, reason, jump_url):
+        """Records a report, a repeated report replaces the older one."""
+        self.reports[(reporter.id, accused.id)] = (
+            reporter, accused, reason, jump_url
+        )
+
+    def embed(self):
+        """Creates the embed summarising every report in the thread."""
+        reports = list(self.reports.values())[::-1]  # newest first
+
+        if self.accused is None:
+            report_embed = discord.Embed(
+                title='Reports!',
+                description='Too many reports at once, so they are ' +
+                'grouped here!',
+                color=discord.Color.blue()
+            )
+            counts = {}
+            for _, accused, _, jump_url in reports:
+                count, _, latest = counts.get(
+                    accused.id, (0, accused, jump_url)
+                )
+                counts[accused.id] = (count + 1, accused, latest)
+            report_embed.add_field(
+                name='Accused',
+                value=limited([
+                    f'{accused.mention}: **{count}**, [latest]({jump_url})'
+                    for count, accused, jump_url in sorted(
+                        counts.values(), key=lambda item: -item[0]
+                    )
+                ]),
+                inline=False
+            )
+            return report_embed
+
+        report_embed = discord.Embed(
+            title='Report!',
+            description='Report a user for their misconducts!',
+            color=discord.Color.blue()
+        )
+        report_embed.set_author(
+            name=str(self.accused),
+            icon_url=self.accused.avatar_url
+        )
+        report_embed.add_field(
+            name='Accused',
+            value=self.accused,
+            inline=False
+        )
+        report_embed.add_field(
+            name='Reporters',
+            value=len(reports),
+            inline=False
+        )
+        report_embed.add_field(
+            name='Reasons & Evidence',
+            value=limited([
+                f'{reporter.mention}: {reason[:100]} [here]({jump_url})'
+                for reporter, _, reason, jump_url in reports[:REPORT_LISTED]
+            ]),
+            inline=False
+        )
+        return report_embed
+
 
 class Moderation(commands.Cog):
     """Typical moderation commands."""
     def __init__(self, bot):
         self.bot = bot
+        self.reports = {}  # (guild_id, accused_id or None) -> ReportThread
+        self.report_posts = {}  # guild_id -> deque of new embed times
+        self.load()
+
+    def load(self):
+        """Loads the warn and mute indexes from disk."""
+        # guild_id -> {member_id: list of warn reasons}
+        with open(WARNS_PATH, 'r') as warns_file:
+            self.warns = {
+                int(guild_key): {
+                    int(member_key): reasons
+                    for member_key, reasons in guild_warns.items()
+                }
+                for guild_key, guild_warns in json.load(warns_file).items()
+            }
+        # (guild_id, member_id, page) -> rendered embed
+        self.warn_pages = OrderedDict()
+
+        # guild_id -> {member_id: role IDs saved when muted}
+        with open(MUTES_PATH, 'r') as mutes_file:
+            self.mutes = {
+                int(guild_key): {
+                    int(member_key): role_ids
+                    for member_key, role_ids in guild_mutes.items()
+                }
+                for guild_key, guild_mutes in json.load(mutes_file).items()
+            }
+
+    def save_warns(self, guild, member):
+        """Writes the warn index to disk, forgets the member's pages."""
+        for key in [key for key in self.warn_pages if key[:2] == (
+            guild.id, member.id
+        )]:
+            del self.warn_pages[key]
+
+        warns = {
+            str(guild_id): {
+                str(member_id): reasons
+                for member_id, reasons in guild_warns.items()
+            }
+            for guild_id, guild_warns in self.warns.items()
+        }
+        with open(WARNS_PATH, 'w') as warns_file:
+            json.dump(warns, warns_file, indent=2)
+
+    def warnings_page(self, guild, member, page):
+        """Renders one page of a member's warnings, cached."""
+        key = (guild.id, member.id, page)
+        if key in self.warn_pages:
+            self.warn_pages.move_to_end(key)
+            return self.warn_pages[key]
+
+        reasons = self.warns.get(guild.id, {}).get(member.id, [])
+        pages = max((len(reasons) - 1) // WARNS_PER_PAGE + 1, 1)
+        warns_plural = 'warning' if len(reasons) == 1 else 'warnings'
+
+        # creating the Embed
+        warnings_embed = discord.Embed(
+            title='Warnings',
+            description=f'**{member}** has {len(reasons)} {warns_plural}!',
+            color=discord.Color.blue()
+        )
+        warnings_embed.set_author(
+            name=member,
+            icon_url=member.avatar_url
+        )
+        warnings_embed.set_footer(text=f'Page {page + 1} of {pages}')
+
+        start = page * WARNS_PER_PAGE
+        for i in range(start, min(start + WARNS_PER_PAGE, len(reasons))):
+            warnings_embed.add_field(
+                name=f'Warning #{i + 1}',
+                value=reasons[i][:1024],
+                inline=False
+            )
+
+        self.warn_pages[key] = warnings_embed
+        if len(self.warn_pages) > WARN_PAGES_CACHED:
+            self.warn_pages.popitem(last=False)
+        return warnings_embed
+
+    def save_mutes(self):
+        """Writes the mute index to disk."""
+        mutes = {
+            str(guild_id): {
+                str(member_id): role_ids
+                for member_id, role_ids in guild_mutes.items()
+            }
+            for guild_id, guild_mutes in self.mutes.items()
+        }
+        with open(MUTES_PATH, 'w') as mutes_file:
+            json.dump(mutes, mutes_file, indent=2)
+
+    def get_muted_role(self, guild):
+        """Returns the guild's muted role, None if it is not set."""
+        options = guild_options(self.bot, guild) or {}
+        muted_role = options.get('muted_role')
+        return guild.get_role(muted_role) if muted_role else None
+
+    async def reconcile_mutes(self, guild):
+        """Gives muted members back their muted role, all at once."""
+        muted_role = self.get_muted_role(guild)
+        if muted_role is None:
+            return
+
+        members = [
+            guild.get_member(member_id)
+            for member_id in self.mutes.get(guild.id, ())
+        ]
+        await asyncio.gather(*(
+            scheduler.high(
+                self.bot, ('member', guild.id), member.edit,
+                roles=[muted_role], reason='Still muted'
+            )
+            for member in members
+            if member is not None and member.roles[1:] != [muted_role]
+        ), return_exceptions=True)
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member):
+        """Mutes members who left and rejoined while muted."""
+        if member.id not in self.mutes.get(member.guild.id, ()):
+            return
+
+        muted_role = self.get_muted_role(member.guild)
+        if muted_role:
+            await scheduler.high(
+                self.bot, ('member', member.guild.id), member.add_roles,
+                muted_role, reason='Still muted'
+            )
 
     async def create_muted_role(self, guild):
         """Create a role that denies permission to send messages."""
@@ -40,22 +269,19 @@ class Moderation(commands.Cog):
         await ctx.message.delete()
 
         # add warn to user
-        with open(WARNS_PATH, 'r') as warns_file:
-            warns = json.load(warns_file)
-
         guild_key = str(ctx.guild.id)
-        member_key = str(member.id)
 
-        if guild_key not in warns:
-            warns[guild_key] = {}
-        if member_key not in warns[guild_key]:
-            warns[guild_key][member_key] = []
-        warns[guild_key][member_key].append(reason)
+        self.warns.setdefault(ctx.guild.id, {}).setdefault(
+            member.id, []
+        ).append(reason)
+        self.save_warns(ctx.guild, member)
 
-        with open(WARNS_PATH, 'w') as warns_file:
-            json.dump(warns, warns_file, indent=2)
+        record(self.bot, ctx.guild, 'warn', member, ctx.author, reason)
 
-        await ctx.send(f'**{member}** has been warned!')
+        scheduler.low(
+            self.bot, ('message', ctx.channel.id), ctx.send,
+            f'**{member}** has been warned!'
+        )
 
         # check for the public_log channel
         with open(OPTIONS_PATH, 'r') as options_file:
@@ -97,7 +323,9 @@ class Moderation(commands.Cog):
             inline=False
         )
 
-        await channel.send(embed=warn_embed)
+        scheduler.low(
+            self.bot, ('message', channel.id), channel.send, embed=warn_embed
+        )
 
     @commands.command()
     @commands.cooldown(1, 1, commands.BucketType.member)
@@ -107,41 +335,49 @@ class Moderation(commands.Cog):
 
         **Example:** `.warnings @ACPlayGames`
         """
-        # gets the warns of the user & parses them
-        with open(WARNS_PATH, 'r') as warns_file:
-            warns = json.load(warns_file)
+        # one page at a time, turned with reactions
+        reasons = self.warns.get(ctx.guild.id, {}).get(member.id, [])
+        pages = max((len(reasons) - 1) // WARNS_PER_PAGE + 1, 1)
+        page = 0
 
-        guild_key = str(ctx.guild.id)
-        member_key = str(member.id)
+        message = await ctx.send(
+            embed=self.warnings_page(ctx.guild, member, page)
+        )
+        if pages == 1:
+            return
 
-        warns_length = 0
-        warns_plural = 'warnings'
+        for reaction in PAGE_REACTIONS:
+            await message.add_reaction(reaction)
+
+        def check(reaction, user):
+            return (
+                reaction.message.id == message.id and
+                user == ctx.author and
+                str(reaction.emoji) in PAGE_REACTIONS
+            )
 
-        if guild_key in warns and member_key in warns[guild_key]:
-            warns_length = len(warns[guild_key][member_key])
-            if warns_length == 1:
-                warns_plural = 'warning'
+        while True:
+            try:
+                reaction, user = await self.bot.wait_for(
+                    'reaction_add', check=check, timeout=PAGE_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                break
 
-        warns_msg = f'**{member}** has {warns_length} {warns_plural}!'
+            step = 1 if str(reaction.emoji) == PAGE_REACTIONS[1] else -1
+            page = (page + step) % pages
 
-        # creating & sending Embed
-        warnings_embed = discord.Embed(
-            title='Warnings',
-            description=warns_msg,
-            color=discord.Color.blue()
-        )
-        warnings_embed.set_author(
-            name=member,
-            icon_url=member.avatar_url
-        )
-        for i in range(warns_length):
-            warnings_embed.add_field(
-                name=f'Warning #{i + 1}',
-                value=warns[guild_key][member_key][i],
-                inline=False
+            await message.edit(
+                embed=self.warnings_page(ctx.guild, member, page)
+            )
+            scheduler.low(
+                self.bot, ('reaction', ctx.channel.id),
+                message.remove_reaction, reaction.emoji, user
             )
 
-        await ctx.send(embed=warnings_embed)
+        scheduler.low(
+            self.bot, ('reaction', ctx.channel.id), message.clear_reactions
+        )
 
     @commands.command()
     @commands.cooldown(1, 1, commands.BucketType.member)
@@ -153,21 +389,13 @@ class Moderation(commands.Cog):
         """
         await ctx.message.delete()
 
-        with open(WARNS_PATH, 'r') as warns_file:
-            warns = json.load(warns_file)
-
-        guild_key = str(ctx.guild.id)
-        member_key = str(member.id)
-
-        if guild_key in warns and member_key in warns[guild_key]:
-            member_warns = warns[guild_key][member_key]
+        member_warns = self.warns.get(ctx.guild.id, {}).get(member.id)
 
+        if member_warns:
             if len(member_warns) >= warn_id > 0:
                 member_warns.pop(warn_id - 1)
                 await ctx.send(f'Warn #{warn_id} has been cleared!')
-
-                with open(WARNS_PATH, 'w') as warns_file:
-                    json.dump(warns, warns_file, indent=2)
+                self.save_warns(ctx.guild, member)
             else:
                 await ctx.send('Invalid ID!')
         else:
@@ -189,7 +417,6 @@ class Moderation(commands.Cog):
             options = json.load(options_file)
 
         guild_key = str(ctx.guild.id)
-        member_key = str(member.id)
 
         if guild_key in options:
             muted_role = options[guild_key]['muted_role']
@@ -211,27 +438,28 @@ class Moderation(commands.Cog):
             json.dump(options, options_file, indent=2)
 
         # remembers & removes current roles, gives Muted role
-        with open(MUTES_PATH, 'r') as mutes_file:
-            mutes = json.load(mutes_file)
-
         roles = member.roles
         roles.remove(ctx.guild.default_role)
 
-        if guild_key not in mutes:
-            mutes[guild_key] = {}
+        guild_mutes = self.mutes.setdefault(ctx.guild.id, {})
 
-        if member_key in mutes[guild_key]:
+        if member.id in guild_mutes:
             await ctx.send('This person is already muted!')
             return
 
-        await member.edit(roles=[muted_role], reason='Muted')
-
-        await ctx.send(f'**{member}** has been muted!')
+        await scheduler.high(
+            self.bot, ('member', ctx.guild.id), member.edit,
+            roles=[muted_role], reason='Muted'
+        )
+        record(self.bot, ctx.guild, 'mute', member, ctx.author, reason)
 
-        mutes[guild_key][member_key] = [role.id for role in roles]
+        scheduler.low(
+            self.bot, ('message', ctx.channel.id), ctx.send,
+            f'**{member}** has been muted!'
+        )
 
-        with open(MUTES_PATH, 'w') as mutes_file:
-            json.dump(mutes, mutes_file, indent=2)
+        guild_mutes[member.id] = [role.id for role in roles]
+        self.save_mutes()
 
         # check for the public_log channel
         with open(OPTIONS_PATH, 'r') as options_file:
@@ -273,7 +501,9 @@ class Moderation(commands.Cog):
             inline=False
         )
 
-        await channel.send(embed=mute_embed)
+        scheduler.low(
+            self.bot, ('message', channel.id), channel.send, embed=mute_embed
+        )
 
     @commands.command()
     @commands.cooldown(1, 1, commands.BucketType.member)
@@ -287,30 +517,31 @@ class Moderation(commands.Cog):
         await ctx.message.delete()
 
         guild_key = str(ctx.guild.id)
-        member_key = str(member.id)
 
         # removes Muted role, returns original roles
-        with open(MUTES_PATH, 'r') as mutes_file:
-            mutes = json.load(mutes_file)
-
-        if guild_key not in mutes:
+        if ctx.guild.id not in self.mutes:
             await ctx.send('No one has been muted before!')
             return
-        if member_key not in mutes[guild_key]:
+        if member.id not in self.mutes[ctx.guild.id]:
             await ctx.send('This person is not muted!')
             return
 
-        role_ids = mutes[guild_key][member_key]
+        role_ids = self.mutes[ctx.guild.id].pop(member.id)
         roles = [ctx.guild.get_role(role_id) for role_id in role_ids]
+        roles = [role for role in roles if role is not None]
 
-        mutes[guild_key].pop(member_key)
-
-        with open(MUTES_PATH, 'w') as mutes_file:
-            json.dump(mutes, mutes_file, indent=2)
+        self.save_mutes()
 
-        await member.edit(roles=roles, reason='Unmuted')
+        await scheduler.high(
+            self.bot, ('member', ctx.guild.id), member.edit,
+            roles=roles, reason='Unmuted'
+        )
+        record(self.bot, ctx.guild, 'unmute', member, ctx.author, reason)
 
-        await ctx.send(f'**{member}** has been unmuted!')
+        scheduler.low(
+            self.bot, ('message', ctx.channel.id), ctx.send,
+            f'**{member}** has been unmuted!'
+        )
 
         # check for the public_log channel
         with open(OPTIONS_PATH, 'r') as options_file:
@@ -352,7 +583,9 @@ class Moderation(commands.Cog):
             inline=False
         )
 
-        await channel.send(embed=unmute_embed)
+        scheduler.low(
+            self.bot, ('message', channel.id), channel.send, embed=unmute_embed
+        )
 
     @commands.command()
     @commands.cooldown(1, 1, commands.BucketType.member)
@@ -364,9 +597,15 @@ class Moderation(commands.Cog):
         **Example:** `.kick @ACPlayGames annoying`
         """
         await ctx.message.delete()
-        await member.kick(reason=reason)
+        await scheduler.high(
+            self.bot, ('kick', ctx.guild.id), member.kick, reason=reason
+        )
+        record(self.bot, ctx.guild, 'kick', member, ctx.author, reason)
 
-        await ctx.send(f'**{member}** has been kicked!')
+        scheduler.low(
+            self.bot, ('message', ctx.channel.id), ctx.send,
+            f'**{member}** has been kicked!'
+        )
 
         guild_key = str(ctx.guild.id)
 
@@ -410,7 +649,9 @@ class Moderation(commands.Cog):
             inline=False
         )
 
-        await channel.send(embed=kick_embed)
+        scheduler.low(
+            self.bot, ('message', channel.id), channel.send, embed=kick_embed
+        )
 
     @commands.command()
     @commands.cooldown(1, 1, commands.BucketType.member)
@@ -423,14 +664,25 @@ class Moderation(commands.Cog):
         await ctx.message.delete()
 
         try:
-            user_conv = commands.UserConverter()
-            member = await user_conv.convert(ctx, user)
+            member = await CachedUser().convert(ctx, user)
         except commands.UserNotFound:
             await ctx.send(VALID_USER)
             return
 
-        await ctx.guild.ban(member, reason=reason)
-        await ctx.send(f'**{member}** has been banned!')
+        await scheduler.high(
+            self.bot, ('ban', ctx.guild.id), ctx.guild.ban,
+            member, reason=reason
+        )
+        record(self.bot, ctx.guild, 'ban', member, ctx.author, reason)
+        scheduler.low(
+            self.bot, ('message', ctx.channel.id), ctx.send,
+            f'**{member}** has been banned!'
+        )
+
+        # shares the ban with other guilds, if opted in
+        federation = self.bot.get_cog('Federation')
+        if federation:
+            await federation.report(ctx.guild, member)
 
         guild_key = str(ctx.guild.id)
 
@@ -474,7 +726,9 @@ class Moderation(commands.Cog):
             inline=False
         )
 
-        await channel.send(embed=ban_embed)
+        scheduler.low(
+            self.bot, ('message', channel.id), channel.send, embed=ban_embed
+        )
 
     @commands.command()
     @commands.cooldown(1, 1, commands.BucketType.member)
@@ -513,9 +767,8 @@ class Moderation(commands.Cog):
         await ctx.message.delete()
 
         if user.isdigit():  # potential user ID
-            try:
-                member = await self.bot.fetch_user(int(user))
-            except discord.NotFound:
+            member = await lookup_user(self.bot, int(user))
+            if member is None:
                 await ctx.send(VALID_USER)
                 return
         else:  # potential username + discriminator
@@ -528,8 +781,15 @@ class Moderation(commands.Cog):
                 await ctx.send(VALID_USER)
                 return
 
-        await ctx.guild.unban(member, reason=reason)
-        await ctx.send(f'**{member}** has been unbanned!')
+        await scheduler.high(
+            self.bot, ('ban', ctx.guild.id), ctx.guild.unban,
+            member, reason=reason
+        )
+        record(self.bot, ctx.guild, 'unban', member, ctx.author, reason)
+        scheduler.low(
+            self.bot, ('message', ctx.channel.id), ctx.send,
+            f'**{member}** has been unbanned!'
+        )
 
         guild_key = str(ctx.guild.id)
 
@@ -573,7 +833,9 @@ class Moderation(commands.Cog):
             inline=False
         )
 
-        await channel.send(embed=unban_embed)
+        scheduler.low(
+            self.bot, ('message', channel.id), channel.send, embed=unban_embed
+        )
 
     @commands.command()
     @commands.cooldown(1, 3, commands.BucketType.member)
@@ -602,33 +864,63 @@ class Moderation(commands.Cog):
 
         channel = ctx.guild.get_channel(channel)
 
-        # creating & sending the embed message
-        report_embed = discord.Embed(
-            title='Report!',
-            description='Report a user for their misconducts!',
-            color=discord.Color.blue()
-        )
-        report_embed.set_author(
-            name=str(ctx.author),
-            icon_url=ctx.author.avatar_url
-        )
-        report_embed.add_field(
-            name='Accused',
-            value=member,
-            inline=False
-        )
-        report_embed.add_field(
-            name='Location',
-            value=f'{ctx.channel.mention}, [here]({ctx.message.jump_url})',
-            inline=False
-        )
-        report_embed.add_field(
-            name='Reason',
-            value=reason,
-            inline=False
+        # one thread per accused user, or one overflow when flooded
+        now = time.monotonic()
+        key = (ctx.guild.id, member.id)
+        thread = self.reports.get(key)
+
+        if thread is None or now - thread.started > REPORT_WINDOW:
+            self.reports = {
+                old_key: old for old_key, old in self.reports.items()
+                if now - old.started <= REPORT_WINDOW
+            }
+            posts = self.report_posts.setdefault(ctx.guild.id, deque())
+            while posts and now - posts[0] > 60:
+                posts.popleft()
+
+            if len(posts) < REPORT_FLOOD:
+                posts.append(now)
+                thread = self.reports[key] = ReportThread(member, now)
+            else:
+                key = (ctx.guild.id, None)
+                thread = self.reports.get(key)
+                if thread is None:
+                    thread = self.reports[key] = ReportThread(None, now)
+
+        thread.add(ctx.author, member, reason, ctx.message.jump_url)
+        await self.post_report(channel, thread)
+
+        scheduler.low(
+            self.bot, ('message', ctx.channel.id), ctx.send,
+            f'{ctx.author.mention}, your report was heard!'
+        )
+
+    async def post_report(self, channel, thread):
+        """Sends a thread's embed, or edits it in place once sent."""
+        bucket = ('message', channel.id)
+
+        if thread.message is not None:
+            await asyncio.wait([thread.message])
+            sent = thread.message
+            message = None
+            if not sent.cancelled() and not sent.exception():
+                message = sent.result()  # None if the send was shed
+            if message is not None:
+                try:
+                    # edits queued close together are merged into one
+                    await scheduler.low(
+                        self.bot, bucket, message.edit,
+                        embed=thread.embed(), merge_key=message.id
+                    )
+                    return
+                except discord.NotFound:
+                    pass  # deleted, so sent again below
+                except discord.HTTPException:
+                    return
+
+        thread.message = scheduler.low(
+            self.bot, bucket, channel.send, embed=thread.embed()
         )
-        await channel.send(embed=report_embed)
-        await ctx.send(f'{ctx.author.mention}, your report was heard!')
 
 
 def setup(bot):
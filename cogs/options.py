@@ -1,9 +1,16 @@
 """Options Cog, allows for customizable options for each guild."""
 
+import ctypes
+import ctypes.util
 import json
+import os
+import re
+import struct
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
+
+from cogs import automod, autoslow
 
 OPTIONS_PATH = './data/options.json'
 ACCEPTED_VALUES = {
@@ -11,33 +18,186 @@ ACCEPTED_VALUES = {
     'public_log': 'Any text channel',
     'private_log': 'Any text channel',
     'mod_role': 'Any role',
-    'muted_role': 'Any role'
+    'muted_role': 'Any role',
+    'quarantine_role': 'Any role',
+    'automod_words': 'Comma-separated words, or `none`',
+    'automod_regex': 'Comma-separated regular expressions, or `none`',
+    'automod_links': 'Comma-separated domains, or `none`',
+    'automod_action': 'delete, warn, mute or kick',
+    'automod_invites': 'on or off',
+    'federation': 'off, alert or ban',
+    'auto_slowmode': '`min-max` seconds (e.g. `0-30`), or `off`'
 }  # text used for an embed
+AUTOMOD_LISTS = ('automod_words', 'automod_regex', 'automod_links')
+
+IN_CLOSE_WRITE = 0x08  # inotify: a file opened for writing was closed
+IN_MOVED_TO = 0x80  # inotify: a file was moved in, e.g. an editor's save
+INOTIFY_EVENT = struct.Struct('iIII')  # wd, mask, cookie, name length
+RELOAD_DELAY = 0.2  # seconds to let a burst of writes settle
+POLL_EVERY = 2  # seconds between mtime checks without inotify
+
+
+def inotify_watch(directory):
+    """Watches a directory with inotify, returns the fd or None."""
+    try:
+        libc = ctypes.CDLL(
+            ctypes.util.find_library('c') or 'libc.so.6', use_errno=True
+        )
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):  # not Linux
+        return None
+
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(
+        fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO
+    ) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def guild_options(bot, guild):
+    """
+    Returns a guild's options from the cache, None if it has none.
+
+    The dictionary is shared, change options through the file instead.
+    """
+    options = bot.get_cog('Options')
+    if options:
+        return options.options.get(str(guild.id))
+
+    with open(OPTIONS_PATH, 'r') as options_file:
+        return json.load(options_file).get(str(guild.id))
 
 
 class Options(commands.Cog):
     """Customizable options for the bot."""
     def __init__(self, bot):
         self.bot = bot
+        self.options = {}  # guild_key -> options, as in the file
+        self.stat = None  # (mtime, size) of the file last loaded
+        self.reloading = None  # pending reload handle
+        self.reload()
+
+        # inotify where available, otherwise the mtime is polled
+        self.inotify = inotify_watch(os.path.dirname(OPTIONS_PATH))
+        if self.inotify is not None:
+            self.bot.loop.add_reader(self.inotify, self.on_inotify)
+        else:
+            self.poll.start()
+
+    def cog_unload(self):
+        """Stops watching the options file."""
+        if self.inotify is not None:
+            self.bot.loop.remove_reader(self.inotify)
+            os.close(self.inotify)
+        else:
+            self.poll.cancel()
+        if self.reloading:
+            self.reloading.cancel()
+
+    def reload(self):
+        """
+        Re-reads the options file, replacing only the guilds that changed.
+
+        Cogs caching something derived from a guild's options are told
+        about that guild alone.
+        """
+        self.reloading = None
+        try:
+            stat = os.stat(OPTIONS_PATH)
+            with open(OPTIONS_PATH, 'r') as options_file:
+                options = json.load(options_file)
+        except (OSError, ValueError):  # mid-write, the next change retries
+            return
+
+        self.stat = (stat.st_mtime_ns, stat.st_size)
+
+        for guild_key in set(options) | set(self.options):
+            old = self.options.get(guild_key)
+            new = options.get(guild_key)
+            if old == new:
+                continue
+
+            if new is None:
+                del self.options[guild_key]
+            else:
+                self.options[guild_key] = new
+
+            guild = self.bot.get_guild(int(guild_key))
+            if guild is None:
+                continue
+
+            automod = self.bot.get_cog('AutoMod')
+            if automod:
+                automod.invalidate(guild)
+            if (old or {}).get('mod_role') != (new or {}).get('mod_role'):
+                self.bot.dispatch('mod_role_update', guild)
+
+    def on_inotify(self):
+        """Reads inotify events, reloads if the options file was written."""
+        try:
+            data = os.read(self.inotify, 4096)
+        except BlockingIOError:
+            return
+
+        name = os.path.basename(OPTIONS_PATH).encode()
+        written = False
+        offset = 0
+        while offset < len(data):
+            *_, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            written |= data[offset:offset + length].rstrip(b'\0') == name
+            offset += length
+
+        if written and self.reloading is None:
+            self.reloading = self.bot.loop.call_later(
+                RELOAD_DELAY, self.reload
+            )
+
+    @tasks.loop(seconds=POLL_EVERY)
+    async def poll(self):
+        """Reloads when the file's mtime or size changes."""
+        try:
+            stat = os.stat(OPTIONS_PATH)
+        except OSError:
+            return
+
+        if (stat.st_mtime_ns, stat.st_size) != self.stat:
+            self.reload()
 
     async def add_guild(self, guild):
         """If the guild options does not exist, add it to the dictionary."""
+        guild_key = str(guild.id)
+
+        if guild_key in self.options:  # already in the file
+            return
+
         with open(OPTIONS_PATH, 'r') as options_file:
             options = json.load(options_file)
 
-        guild_key = str(guild.id)
-
         if guild_key not in options:
             options[guild_key] = {
                 'prefix': '.',
                 'public_log': None,
                 'private_log': None,
                 'mod_role': None,
-                'muted_role': None
+                'muted_role': None,
+                'quarantine_role': None,
+                'quarantine': False,
+                'automod_words': [],
+                'automod_regex': [],
+                'automod_links': [],
+                'automod_action': 'delete',
+                'automod_invites': False,
+                'federation': 'off',
+                'auto_slowmode': None
             }  # append default values
 
         with open(OPTIONS_PATH, 'w') as options_file:
             json.dump(options, options_file, indent=2)
+        self.reload()
 
     async def change_option(self, ctx, option, *, new_option):
         """Change an option with the 'settings' command."""
@@ -57,13 +217,51 @@ class Options(commands.Cog):
             options[guild_key][option] = text_channel.id
 
         # discord.Role
-        elif option in ('mod_role', 'muted_role'):
+        elif option in ('mod_role', 'muted_role', 'quarantine_role'):
             role_conv = commands.RoleConverter()
             role = await role_conv.convert(ctx, new_option)
             options[guild_key][option] = role.id
 
+        # AutoMod rules, recompiled on the next message
+        elif option in AUTOMOD_LISTS:
+            rules = [] if new_option.lower() == 'none' else [
+                rule.strip() for rule in new_option.split(',') if rule.strip()
+            ]
+            try:
+                automod.compile_rules({option: rules})
+            except re.error as error:
+                await ctx.send(f'Invalid regular expression: `{error}`')
+                return
+            options[guild_key][option] = rules
+
+        elif option == 'automod_action':
+            if new_option.lower() not in automod.ACTIONS:
+                await ctx.send(f'Accepted values: {ACCEPTED_VALUES[option]}')
+                return
+            options[guild_key][option] = new_option.lower()
+
+        elif option == 'automod_invites':
+            if new_option.lower() not in ('on', 'off'):
+                await ctx.send(f'Accepted values: {ACCEPTED_VALUES[option]}')
+                return
+            options[guild_key][option] = new_option.lower() == 'on'
+
+        elif option == 'auto_slowmode':
+            bounds = autoslow.parse_bounds(new_option)
+            if new_option.lower() != 'off' and not bounds:
+                await ctx.send(f'Accepted values: {ACCEPTED_VALUES[option]}')
+                return
+            options[guild_key][option] = bounds
+
+        elif option == 'federation':
+            if new_option.lower() not in ('off', 'alert', 'ban'):
+                await ctx.send(f'Accepted values: {ACCEPTED_VALUES[option]}')
+                return
+            options[guild_key][option] = new_option.lower()
+
         with open(OPTIONS_PATH, 'w') as options_file:
             json.dump(options, options_file, indent=2)
+        self.reload()  # picks the change up at once, not on the next event
 
         await ctx.send(f'**{option}** is now **{new_option}**')
 
@@ -116,7 +314,7 @@ class Options(commands.Cog):
 
     @commands.command(aliases=['options'])
     @commands.cooldown(1, 1, commands.BucketType.guild)
-    async def settings(self, ctx, option=None, new_option=None):
+    async def settings(self, ctx, option=None, *, new_option=None):
         """Configure customizable settings."""
         if not option:  # sends info about all the options
             settings_embed = discord.Embed(
@@ -149,10 +347,48 @@ class Options(commands.Cog):
                 value='Selects mute role to be given to muted users.',
                 inline=False
             )
+            settings_embed.add_field(
+                name='quarantine_role',
+                value='Selects role given to joiners during quarantine.',
+                inline=False
+            )
+            settings_embed.add_field(
+                name='automod_words',
+                value='Words that AutoMod removes.',
+                inline=False
+            )
+            settings_embed.add_field(
+                name='automod_regex',
+                value='Regular expressions that AutoMod removes.',
+                inline=False
+            )
+            settings_embed.add_field(
+                name='automod_links',
+                value='Link domains that AutoMod removes.',
+                inline=False
+            )
+            settings_embed.add_field(
+                name='automod_action',
+                value='What AutoMod does to the author of a match.',
+                inline=False
+            )
+            settings_embed.add_field(
+                name='automod_invites',
+                value='Whether AutoMod removes Discord invites.',
+                inline=False
+            )
+            settings_embed.add_field(
+                name='federation',
+                value='Shares bans with other guilds and checks joiners.',
+                inline=False
+            )
+            settings_embed.add_field(
+                name='auto_slowmode',
+                value='Slowmode bounds for busy channels, or off.',
+                inline=False
+            )
             await ctx.send(embed=settings_embed)
-        elif option.lower() in (
-            'prefix', 'public_log', 'private_log', 'mod_role', 'muted_role'
-        ):
+        elif option.lower() in ACCEPTED_VALUES:
             option = option.lower()
             guild_key = str(ctx.guild.id)
             await self.add_guild(ctx.guild)
@@ -161,12 +397,18 @@ class Options(commands.Cog):
                 options = json.load(options_file)
 
             if not new_option:  # sends info about selected option
-                current_value = options[guild_key][option]
+                current_value = options[guild_key].get(option)
+                if option in AUTOMOD_LISTS:
+                    current_value = ', '.join(
+                        f'`{rule}`' for rule in current_value or []
+                    ) or None
                 if current_value:
                     if option in ('public_log', 'private_log'):
                         current_value = ctx.guild.get_channel(current_value)
                         current_value = current_value.mention
-                    elif option in ('mod_role', 'muted_role'):
+                    elif option in (
+                        'mod_role', 'muted_role', 'quarantine_role'
+                    ):
                         current_value = ctx.guild.get_role(current_value)
                         current_value = current_value.mention
 
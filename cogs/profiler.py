@@ -0,0 +1,127 @@
+"""Profiler Cog, captures what the bot is busy doing in production."""
+
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import tracemalloc
+
+import discord
+from discord.ext import commands
+
+MAX_SECONDS = 300
+TOP_FUNCTIONS = 40
+COGS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def module_of(filename):
+    """Maps a source file to a readable module name (e.g. cogs.logs)."""
+    path = os.path.abspath(filename)
+
+    if os.path.dirname(path) == COGS_DIR:
+        return 'cogs.' + os.path.splitext(os.path.basename(path))[0]
+    if 'site-packages' in path:
+        package = path.split('site-packages' + os.sep, 1)[1]
+        return package.split(os.sep, 1)[0]
+    return os.path.basename(path)
+
+
+class Profiler(commands.Cog):
+    """Owner tools to find out why the bot is slow."""
+    def __init__(self, bot):
+        self.bot = bot
+        self.running = False  # only one capture at a time
+
+    async def capture_cpu(self, seconds):
+        """Runs cProfile over the event loop for the given window."""
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+
+        report = io.StringIO()
+        stats = pstats.Stats(profile, stream=report)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+        return report.getvalue()
+
+    async def capture_memory(self, seconds):
+        """Diffs two tracemalloc snapshots and groups growth per module."""
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        try:
+            before = tracemalloc.take_snapshot()
+            await asyncio.sleep(seconds)
+            after = tracemalloc.take_snapshot()
+        finally:
+            if started:  # leave no overhead behind
+                tracemalloc.stop()
+
+        stats = after.compare_to(before, 'lineno')
+
+        per_module = {}
+        for stat in stats:
+            module = module_of(stat.traceback[0].filename)
+            size, count = per_module.get(module, (0, 0))
+            per_module[module] = (
+                size + stat.size_diff,
+                count + stat.count_diff
+            )
+
+        lines = [f'Memory growth over {seconds} seconds', '', 'Per module:']
+        ranked = sorted(
+            per_module.items(), key=lambda item: item[1][0], reverse=True
+        )
+        for module, (size, count) in ranked:
+            lines.append(f'{size / 1024:+10.1f} KiB {count:+7d}  {module}')
+
+        lines += ['', 'Top lines:']
+        for stat in stats[:TOP_FUNCTIONS]:
+            lines.append(str(stat))
+
+        return '\n'.join(lines)
+
+    @commands.command()
+    @commands.is_owner()
+    async def profile(self, ctx, seconds: int, mode='cpu'):
+        """
+        Profiles the bot for a few seconds (Owner only!)
+
+        Modes are `cpu` (cProfile) and `memory` (tracemalloc).
+        **Example:** `.profile 30 memory`
+        """
+        mode = mode.lower()
+
+        if not 1 <= seconds <= MAX_SECONDS:
+            await ctx.send(f'Seconds must be between `1` and `{MAX_SECONDS}`!')
+            return
+        if mode not in ('cpu', 'memory'):
+            await ctx.send('Mode must be `cpu` or `memory`!')
+            return
+        if self.running:
+            await ctx.send('A profile is already running!')
+            return
+
+        self.running = True
+        await ctx.send(f'Profiling `{mode}` for `{seconds}` seconds...')
+        try:
+            if mode == 'cpu':
+                report = await self.capture_cpu(seconds)
+            else:
+                report = await self.capture_memory(seconds)
+        finally:
+            self.running = False
+
+        report_file = discord.File(
+            io.BytesIO(report.encode()),
+            filename=f'profile-{mode}.txt'
+        )
+        await ctx.send(content='Profile complete!', file=report_file)
+
+
+def setup(bot):
+    """Adds the Profiler cog to the bot."""
+    bot.add_cog(Profiler(bot))
@@ -0,0 +1,192 @@
+"""Scheduler Cog, orders outgoing REST actions by how much they matter."""
+
+import asyncio
+from collections import deque
+import time
+from typing import Any, Callable, Hashable, NamedTuple
+
+from discord.ext import commands
+
+HIGH = 0  # bans, mutes, kicks, lockdown edits
+LOW = 1  # log embeds, chat confirmations
+
+# Buckets follow Discord's routes and their major parameter, e.g.
+# ('ban', guild_id) or ('channel', channel_id). These only spread the
+# workers across routes, discord.py still waits out any 429 it gets.
+LIMITS = {
+    'message': (5, 5.0),  # sends and message edits per channel
+    'reaction': (4, 1.0),  # reaction removals per channel
+    'channel': (5, 5.0),  # channel edits and overwrites per channel
+    'guild': (5, 5.0),  # channel creation per guild
+    'member': (10, 1.0),  # member edits and role changes per guild
+    'ban': (10, 1.0),  # bans and unbans per guild
+    'kick': (10, 1.0),  # kicks per guild
+}  # bucket kind -> (calls, per seconds)
+DEFAULT_LIMIT = (5, 5.0)
+WORKERS = 4
+LOW_LIMIT = 200  # queued low-priority actions before the oldest are shed
+
+
+class Action(NamedTuple):
+    """An outgoing API call waiting for its turn."""
+    bucket: Hashable
+    func: Callable[..., Any]
+    args: tuple
+    kwargs: dict
+    merge_key: Hashable
+    future: asyncio.Future
+
+
+class Scheduler(commands.Cog):
+    """Runs moderation actions ahead of cosmetic ones."""
+    def __init__(self, bot):
+        self.bot = bot
+        self.queues = (deque(), deque())  # HIGH, LOW
+        self.merged = {}  # merge_key -> queued low-priority Action
+        self.calls = {}  # bucket -> deque of recent call times
+        self.wakeup = asyncio.Event()
+        self.workers = []
+        self.shed = 0
+
+    def cog_unload(self):
+        """Stops the workers, queued actions are dropped."""
+        for worker in self.workers:
+            worker.cancel()
+        for queue in self.queues:
+            for action in queue:
+                action.future.cancel()
+
+    def submit(self, priority, bucket, func, *args, merge_key=None,
+               **kwargs):
+        """
+        Queues `func(*args, **kwargs)` and returns a future for its result.
+
+        A low-priority action with the same `merge_key` as one still queued
+        replaces it. Shed actions resolve to None.
+        """
+        loop = asyncio.get_event_loop()
+        if not self.workers:
+            self.workers = [
+                loop.create_task(self.work()) for _ in range(WORKERS)
+            ]
+
+        queue = self.queues[priority]
+        old = self.merged.get(merge_key) if priority == LOW else None
+
+        if old is not None:  # newer content wins, keeps its place
+            action = Action(bucket, func, args, kwargs, merge_key, old.future)
+            queue[queue.index(old)] = action
+        else:
+            action = Action(
+                bucket, func, args, kwargs, merge_key, loop.create_future()
+            )
+            queue.append(action)
+
+        if priority == LOW:
+            if merge_key is not None:
+                self.merged[merge_key] = action
+
+            while len(queue) > LOW_LIMIT:
+                dropped = queue.popleft()
+                self.forget(dropped)
+                if not dropped.future.done():
+                    dropped.future.set_result(None)
+                self.shed += 1
+
+        self.wakeup.set()
+        return action.future
+
+    def forget(self, action):
+        """Removes an action from the merge table."""
+        if self.merged.get(action.merge_key) is action:
+            del self.merged[action.merge_key]
+
+    def bucket_wait(self, bucket, now):
+        """Seconds until the bucket allows another call."""
+        calls = self.calls.get(bucket)
+        if not calls:
+            return 0
+
+        limit, period = LIMITS.get(bucket[0], DEFAULT_LIMIT)
+        while calls and now - calls[0] >= period:
+            calls.popleft()
+
+        if len(calls) < limit:
+            return 0
+        return calls[0] + period - now
+
+    def next_action(self):
+        """
+        Takes the first runnable action, high priority first.
+
+        Returns the action, or None and how long until one is runnable.
+        """
+        now = time.monotonic()
+        delay = None
+
+        for queue in self.queues:
+            for index, action in enumerate(queue):
+                wait = self.bucket_wait(action.bucket, now)
+                if wait <= 0:
+                    del queue[index]
+                    self.forget(action)
+                    self.calls.setdefault(action.bucket, deque()).append(now)
+                    return action, None
+                delay = wait if delay is None else min(delay, wait)
+
+        return None, delay
+
+    async def work(self):
+        """Worker loop, runs actions as their buckets allow."""
+        while True:
+            action, delay = self.next_action()
+
+            if action is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            if action.future.done():  # cancelled by the caller
+                continue
+
+            try:
+                result = await action.func(*action.args, **action.kwargs)
+            except Exception as error:
+                if not action.future.done():
+                    action.future.set_exception(error)
+            else:
+                if not action.future.done():
+                    action.future.set_result(result)
+
+
+async def high(bot, bucket, func, *args, **kwargs):
+    """Runs a protective action as soon as its bucket allows."""
+    scheduler = bot.get_cog('Scheduler')
+    if scheduler is None:
+        return await func(*args, **kwargs)
+    return await scheduler.submit(HIGH, bucket, func, *args, **kwargs)
+
+
+def low(bot, bucket, func, *args, merge_key=None, **kwargs):
+    """Queues a cosmetic action, await the result only if it is needed."""
+    scheduler = bot.get_cog('Scheduler')
+    if scheduler is None:
+        future = asyncio.ensure_future(func(*args, **kwargs))
+    else:
+        future = scheduler.submit(
+            LOW, bucket, func, *args, merge_key=merge_key, **kwargs
+        )
+
+    # cosmetic failures should not be reported as unretrieved errors
+    future.add_done_callback(
+        lambda done: done.cancelled() or done.exception()
+    )
+    return future
+
+
+def setup(bot):
+    """Adds the Scheduler cog to the bot."""
+    bot.add_cog(Scheduler(bot))
@@ -0,0 +1,87 @@
+"""Snapshot Cog, carries detection state over a restart."""
+
+import mmap
+import os
+import pickle
+import time
+
+from discord.ext import commands, tasks
+
+SNAPSHOT_PATH = './data/snapshot.bin'
+MAGIC = b'ARSNAP1\n'
+VERSION = 1  # bump when a cog changes the shape of its state
+MAX_AGE = 86400  # seconds, older snapshots are ignored
+SAVE_EVERY = 300  # seconds, so a crash loses little
+
+
+class Snapshot(commands.Cog):
+    """
+    Saves and restores the in-memory state of every cog.
+
+    A cog takes part by defining `snapshot_state()`, returning something
+    picklable, and `restore_state(state)`. Restored objects skip
+    `__init__`, so changing their attributes needs a new `VERSION`.
+    """
+    def __init__(self, bot):
+        self.bot = bot
+        self.autosave.start()
+
+    def cog_unload(self):
+        """Stops saving periodically."""
+        self.autosave.cancel()
+
+    def save(self):
+        """Writes the state of every cog into one binary file."""
+        state = {
+            name: cog.snapshot_state()
+            for name, cog in self.bot.cogs.items()
+            if hasattr(cog, 'snapshot_state')
+        }
+        data = pickle.dumps(
+            (VERSION, time.time(), state), protocol=pickle.HIGHEST_PROTOCOL
+        )
+
+        with open(SNAPSHOT_PATH + '.tmp', 'wb') as snapshot_file:
+            snapshot_file.write(MAGIC)
+            snapshot_file.write(data)
+        os.replace(SNAPSHOT_PATH + '.tmp', SNAPSHOT_PATH)
+
+    def restore(self):
+        """Maps the snapshot and hands each cog its state back."""
+        try:
+            with open(SNAPSHOT_PATH, 'rb') as snapshot_file:
+                with mmap.mmap(
+                    snapshot_file.fileno(), 0, access=mmap.ACCESS_READ
+                ) as mapped:
+                    if mapped[:len(MAGIC)] != MAGIC:
+                        return
+                    version, saved_at, state = pickle.loads(
+                        mapped[len(MAGIC):]
+                    )
+        except Exception:
+            return  # missing, corrupt or of renamed classes, start cold
+
+        if version != VERSION or time.time() - saved_at > MAX_AGE:
+            return
+
+        for name, cog_state in state.items():
+            cog = self.bot.get_cog(name)
+            if cog is not None and hasattr(cog, 'restore_state'):
+                cog.restore_state(cog_state)
+
+    @tasks.loop(seconds=SAVE_EVERY)
+    async def autosave(self):
+        """Saves periodically in case the bot does not shut down cleanly."""
+        self.save()
+
+    @autosave.before_loop
+    async def before_autosave(self):
+        """Waits until the restored state is in use."""
+        await self.bot.wait_until_ready()
+
+
+def setup(bot):
+    """Adds the Snapshot cog to the bot and restores the saved state."""
+    snapshot = Snapshot(bot)
+    bot.add_cog(snapshot)
+    snapshot.restore()
@@ -1,30 +1,52 @@
 """Server Anti-Raid, developed by ACPlayGames!"""
 
-import json
-
 import discord
 from discord.ext import commands
 
+from cogs.options import guild_options
+
+# 'full' caches every member and chunks every guild at startup.
+# 'lean' caches joiners, muted members and members whose roles change,
+# and chunks a guild only when a command such as `.scan` needs it.
+MEMBER_CACHE = 'lean'
+
 
 async def get_prefix(bot_, message):
     """Returns the appropriate prefix for the bot."""
-    with open('./data/options.json', 'r') as options_file:
-        options_dict = json.load(options_file)
-
-    if message.guild and str(message.guild.id) in options_dict:
-        prefixes = options_dict[str(message.guild.id)]['prefix']
-    else:
-        prefixes = '.'
+    options = guild_options(bot_, message.guild) if message.guild else None
+    prefixes = options['prefix'] if options else '.'
 
     return commands.when_mentioned_or(*prefixes)(bot_, message)
 
 intents = discord.Intents.default()
 intents.members = True
 
-bot = commands.Bot(
+if MEMBER_CACHE == 'full':
+    member_cache_flags = discord.MemberCacheFlags.from_intents(intents)
+else:
+    member_cache_flags = discord.MemberCacheFlags.none()
+    member_cache_flags.joined = True
+
+
+class AntiRaidBot(commands.Bot):
+    """Bot that saves its detection state before shutting down."""
+    async def close(self):
+        """Saves the snapshot and pending fingerprints, then disconnects."""
+        snapshot = self.get_cog('Snapshot')
+        if snapshot:
+            snapshot.save()
+        evasion = self.get_cog('Evasion')
+        if evasion:
+            evasion.flush()
+        await super().close()
+
+
+bot = AntiRaidBot(
     command_prefix=get_prefix,
     case_insensitive=True,
-    intents=intents
+    intents=intents,
+    member_cache_flags=member_cache_flags,
+    chunk_guilds_at_startup=MEMBER_CACHE == 'full'
 )
 bot.remove_command('help')
 
@@ -71,6 +93,39 @@ async def on_command_error(ctx, error):
             await ctx.send(error)
 
 
+# guild_id -> {member_id: (role IDs, whether the member may use the bot)}
+authorized = {}
+
+
+def is_authorized(ctx, member, decide):
+    """
+    Returns the cached decision for a member, deciding it once.
+
+    Entries are keyed on the member's role IDs as well, because role
+    changes of uncached members do not dispatch `on_member_update`.
+    """
+    guild_cache = authorized.setdefault(ctx.guild.id, {})
+    role_ids = tuple(role.id for role in member.roles)
+    entry = guild_cache.get(member.id)
+    if entry is None or entry[0] != role_ids:
+        entry = guild_cache[member.id] = (role_ids, decide())
+    return entry[1]
+
+
+def mod_decision(ctx):
+    """Whether the author has the mod role or administrator permission."""
+    author = ctx.author
+    options = guild_options(ctx.bot, ctx.guild)
+
+    if options is None:
+        mod_role = None
+    else:
+        mod_role = ctx.guild.get_role(options['mod_role'])
+
+    admin_perms = author.guild_permissions.administrator
+    return mod_role in author.roles or admin_perms
+
+
 @bot.check
 async def global_check(ctx):
     """Bot checks for permissions and the location of the message."""
@@ -78,32 +133,62 @@ async def global_check(ctx):
     await commands.guild_only().predicate(ctx)
 
     # check for bot permissions in guild, raises error if not
-    await commands.bot_has_guild_permissions(
-        administrator=True).predicate(ctx)
+    me = ctx.guild.me
+    if not is_authorized(
+        ctx, me, lambda: me.guild_permissions.administrator
+    ):
+        raise commands.BotMissingPermissions(['administrator'])
 
     # anyone can use report command
     if ctx.command.name == 'report':
         return True
 
     # not report command, check for user permissions in guild
-    author = ctx.author
-    with open('./data/options.json', 'r') as options_file:
-        options = json.load(options_file)
+    return is_authorized(ctx, ctx.author, lambda: mod_decision(ctx))
 
-    guild_key = str(ctx.guild.id)
-    if guild_key not in options:
-        mod_role = None
-    else:
-        mod_role = options[guild_key]['mod_role']
-        mod_role = ctx.guild.get_role(mod_role)
 
-    admin_perms = author.guild_permissions.administrator
-    return mod_role in author.roles or admin_perms
+@bot.event
+async def on_member_update(before, after):
+    """Forgets a member's cached permissions when their roles change."""
+    if before.roles != after.roles:
+        authorized.get(after.guild.id, {}).pop(after.id, None)
 
-bot.load_extension('cogs.lockdown')
-bot.load_extension('cogs.logs')
-bot.load_extension('cogs.moderation')
-bot.load_extension('cogs.options')
+
+@bot.event
+async def on_member_remove(member):
+    """Forgets the cached permissions of members who leave."""
+    authorized.get(member.guild.id, {}).pop(member.id, None)
+
+
+@bot.event
+async def on_member_join(member):
+    """Forgets cached permissions left over from an earlier stay."""
+    authorized.get(member.guild.id, {}).pop(member.id, None)
+
+
+@bot.event
+async def on_guild_update(before, after):
+    """Forgets the guild's cached permissions if the owner changed."""
+    if before.owner_id != after.owner_id:
+        authorized.pop(after.id, None)
+
+
+@bot.event
+async def on_guild_role_update(before, after):
+    """Forgets the guild's cached permissions, a role's may have changed."""
+    authorized.pop(after.guild.id, None)
+
+
+@bot.event
+async def on_guild_role_delete(role):
+    """Forgets the guild's cached permissions, the mod role may be gone."""
+    authorized.pop(role.guild.id, None)
+
+
+@bot.event
+async def on_mod_role_update(guild):
+    """Forgets the guild's cached permissions after `settings mod_role`."""
+    authorized.pop(guild.id, None)
 
 
 @bot.command(name='help')
@@ -138,15 +223,40 @@ async def help_(ctx, command=None):
     )
 
     if not command:
+        help_embed.add_field(
+            name='Backup',
+            value='`backup`',
+            inline=False
+        )
+        help_embed.add_field(
+            name='Cases',
+            value='`case` `cases` `modstats`',
+            inline=False
+        )
+        help_embed.add_field(
+            name='Clusters',
+            value='`cluster`',
+            inline=False
+        )
+        help_embed.add_field(
+            name='Federation',
+            value='`federation`',
+            inline=False
+        )
         help_embed.add_field(
             name='Lockdown',
-            value='`lock` `unlock` `lockall` `unlockall` `purge` ' +
-            '`slowmode`',
+            value='`lock` `unlock` `lockall` `unlockall` `lockcheck` ' +
+            '`purge` `slowmode` `quarantine` `release` `raidpurge`',
             inline=False
         )
         help_embed.add_field(
             name='Logs',
-            value='`check`',
+            value='`check` `scan` `created`',
+            inline=False
+        )
+        help_embed.add_field(
+            name='Members',
+            value='`usercache`',
             inline=False
         )
         help_embed.add_field(
@@ -160,6 +270,11 @@ async def help_(ctx, command=None):
             value='`settings`',
             inline=False
         )
+        help_embed.add_field(
+            name='Profiler',
+            value='`profile`',
+            inline=False
+        )
     elif command is not None and command.lower() in cog_dict:
         cmds = cog_dict[command.lower()].get_commands()
 
@@ -172,4 +287,23 @@ async def help_(ctx, command=None):
 
     await ctx.send(embed=help_embed)
 
-bot.run('TOKEN HERE')
+if __name__ == '__main__':  # analysis workers import this file too
+    bot.load_extension('cogs.analysis')
+    bot.load_extension('cogs.antinuke')
+    bot.load_extension('cogs.automod')
+    bot.load_extension('cogs.autoslow')
+    bot.load_extension('cogs.backup')
+    bot.load_extension('cogs.cases')
+    bot.load_extension('cogs.clusters')
+    bot.load_extension('cogs.evasion')
+    bot.load_extension('cogs.federation')
+    bot.load_extension('cogs.lockdown')
+    bot.load_extension('cogs.logs')
+    bot.load_extension('cogs.members')
+    bot.load_extension('cogs.moderation')
+    bot.load_extension('cogs.options')
+    bot.load_extension('cogs.scheduler')
+    bot.load_extension('cogs.profiler')
+    bot.load_extension('cogs.snapshot')  # last, restores the other cogs
+
+    bot.run('TOKEN HERE')